@@ -0,0 +1,156 @@
+"""Embedding backend parity benchmark.
+
+Runs each embedding backend in its own process on a fixed corpus and reports
+load time, single-text latency, batch throughput, resident memory and cosine
+agreement with the torch backend.
+
+Run from the backend directory (export the ONNX models first with
+`python -m db.onnx_export --quantize`):
+
+    python -m bench.embedding_parity [--backends torch onnx onnx-int8] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_OPENERS = ["hey", "omg", "lol", "honestly", "wait", "ok so", "ugh", "haha", "btw", "yo"]
+_SUBJECTS = ["my boss", "the new show", "that pasta place", "your sister", "the concert",
+             "my roommate", "the exam", "our trip", "this weather", "the gym"]
+_VERBS = ["was", "is literally", "seemed", "turned out", "keeps being", "felt"]
+_OBJECTS = ["amazing", "so awkward", "kind of boring", "way better than I expected",
+            "a total disaster", "weirdly fun", "exhausting", "the highlight of my week"]
+_TAILS = ["", " what do you think?", " we should go sometime", " anyway how was your day",
+          " I can't stop thinking about it", " remind me to tell you the rest"]
+
+
+def build_corpus(size=256, seed=0):
+    """Deterministic chat-like corpus, including a few texts longer than the model limit"""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        text = (f"{rng.choice(_OPENERS)} {rng.choice(_SUBJECTS)} {rng.choice(_VERBS)} "
+                f"{rng.choice(_OBJECTS)}.{rng.choice(_TAILS)}")
+        if i % 50 == 0:
+            text = " ".join([text] * 40)
+        corpus.append(text)
+    return corpus
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_worker(backend, out_path, corpus_size, repeats):
+    sys.path.insert(0, BACKEND_DIR)
+    from db.embeddings import load_model
+
+    corpus = build_corpus(corpus_size)
+    rss_start = _rss_mb()
+    started = time.perf_counter()
+    model = load_model(backend)
+    model.encode(["warmup"])
+    load_seconds = time.perf_counter() - started
+    rss_loaded = _rss_mb()
+
+    single = []
+    for text in corpus[:64]:
+        t = time.perf_counter()
+        model.encode([text])
+        single.append(time.perf_counter() - t)
+
+    batch_times = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        vectors = np.asarray(model.encode(corpus), dtype=np.float32)
+        batch_times.append(time.perf_counter() - t)
+
+    np.save(out_path, vectors)
+    single.sort()
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 3),
+        "single_p50_ms": round(statistics.median(single) * 1000, 2),
+        "single_p95_ms": round(single[int(len(single) * 0.95) - 1] * 1000, 2),
+        "throughput_texts_per_s": round(len(corpus) / statistics.median(batch_times), 1),
+        "rss_model_mb": round(rss_loaded - rss_start, 1),
+        "rss_total_mb": round(_rss_mb(), 1)
+    }
+
+
+def _cosines(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--corpus-size", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.out, args.corpus_size, args.repeats)))
+        return
+
+    results = []
+    vectors = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends:
+            out_path = os.path.join(tmp, f"{backend}.npy")
+            # A fresh process per backend keeps the memory numbers honest
+            proc = subprocess.run(
+                [sys.executable, "-m", "bench.embedding_parity", "--worker", backend, "--out", out_path,
+                 "--corpus-size", str(args.corpus_size), "--repeats", str(args.repeats)],
+                cwd=BACKEND_DIR, capture_output=True, text=True
+            )
+            if proc.returncode != 0:
+                print(f"{backend}: failed\n{proc.stderr.strip()}", file=sys.stderr)
+                continue
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            vectors[backend] = np.load(out_path)
+
+    reference = vectors.get("torch")
+    for result in results:
+        if reference is not None and result["backend"] in vectors:
+            cos = _cosines(reference, vectors[result["backend"]])
+            result["cosine_mean"] = round(float(cos.mean()), 5)
+            result["cosine_min"] = round(float(cos.min()), 5)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    columns = ["backend", "load_seconds", "single_p50_ms", "single_p95_ms",
+               "throughput_texts_per_s", "rss_model_mb", "cosine_mean", "cosine_min"]
+    print("  ".join(f"{c:>14}" for c in columns))
+    for result in results:
+        print("  ".join(f"{str(result.get(c, '-')):>14}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
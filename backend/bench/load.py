@@ -0,0 +1,336 @@
+"""Offline load test of the API with stand-in backends.
+
+Runs the FastAPI app in-process (lifespan included) against:
+  - FakeBackend for Gemini, with a configurable latency distribution
+  - an in-memory Mongo stand-in (bench/memory_mongo.py)
+  - an embedded Chroma in a temporary directory
+  - a hash-based embedder (or the real model with --embedder model)
+
+It drives /send_message, /suggest, /get_history and /list_personas at each
+concurrency level and reports p50/p95/p99 latency, throughput and the average
+time per request spent in each stage (Mongo, embedding, Chroma, persona, LLM).
+
+Run from the backend directory:
+
+    python -m bench.load [--concurrency 1 8 32] [--requests 200]
+                         [--llm-latency lognormal:0.3,0.4] [--json]
+    python -m bench.load --save-baseline bench/baseline.json
+    python -m bench.load --baseline bench/baseline.json --tolerance 0.2
+
+With --baseline the run exits with status 1 if any scenario's p50/p95 rose,
+or its throughput fell, by more than the tolerance.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["list_personas", "get_history", "send_message", "suggest"]
+
+_TOPICS = ["work", "the weekend", "that new show", "dinner", "the gym", "music", "travel plans", "your day"]
+
+
+class HashEmbedder:
+    """Deterministic stand-in for the embedding model (no model download, ~free)"""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def encode(self, texts):
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vec = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            out[i] = vec / np.linalg.norm(vec)
+        return out
+
+
+class StageTimer:
+    """Accumulates wall time spent inside wrapped functions, per stage"""
+
+    def __init__(self):
+        self.totals = {}
+
+    def reset(self):
+        self.totals = {}
+
+    def _add(self, stage, elapsed):
+        total, calls = self.totals.get(stage, (0.0, 0))
+        self.totals[stage] = (total + elapsed, calls + 1)
+
+    def wrap(self, module, name, stage):
+        fn = getattr(module, name)
+        if asyncio.iscoroutinefunction(fn):
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self._add(stage, time.perf_counter() - started)
+        else:
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self._add(stage, time.perf_counter() - started)
+        setattr(module, name, timed)
+
+
+def _instrument(timer):
+    from services import chat, recommendation
+    from services.agent import get_backend
+
+    timer.wrap(chat, "embed", "embedding")
+    timer.wrap(chat, "get_recent_context", "mongo_read")
+    timer.wrap(chat, "save_messages", "mongo_write")
+    timer.wrap(chat, "query_similar", "chroma_query")
+    timer.wrap(chat, "get_persona_from_db", "persona")
+    timer.wrap(chat, "get_persona_derived", "persona")
+    timer.wrap(recommendation, "get_messages", "mongo_read")
+    timer.wrap(recommendation, "fetch_recommendations_from_db", "mongo_read")
+    timer.wrap(recommendation, "append_recommendations", "mongo_write")
+    timer.wrap(recommendation, "get_user_profile", "mongo_read")
+    timer.wrap(recommendation, "get_persona_from_db", "persona")
+    # Every LLM call goes through the backend, whichever module made it
+    backend = get_backend()
+    timer.wrap(backend, "generate", "llm")
+
+
+def _requests_per_user(args):
+    """Most LLM-backed requests the run sends for any one user (see _run_level's plan)"""
+    rng = random.Random(args.seed)
+    counts = [0] * args.users
+    for _ in range(args.requests):
+        counts[rng.choice(range(args.users))] += 1
+    levels = len(args.concurrency) * len([s for s in args.scenarios if s in ("send_message", "suggest")])
+    return args.setup_turns + max(counts) * levels
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def _setup(client, users, turns, rng):
+    sessions = []
+    for u in range(users):
+        user_id = f"bench-user-{u}"
+        await client.put("/update_profile", json={
+            "user_id": user_id, "name": f"User {u}", "bio": "benchmark user",
+            "goals": "be more engaging", "interests": "music, travel", "communicationStyle": "casual"
+        })
+        resp = await client.post("/create_persona", json={
+            "userId": user_id, "name": f"Persona {u}", "description": "friend",
+            "traits": "witty, warm", "interests": "films, food", "writingStyle": "short texts, emojis",
+            "previousChat": " ".join(f"we talked about {rng.choice(_TOPICS)}" for _ in range(60))
+        })
+        persona_id = resp.json()["persona_id"]
+        sessions.append((user_id, persona_id))
+        for t in range(turns):
+            await client.post("/send_message", json={
+                "session_id": user_id, "persona_id": persona_id, "persona_instructions": "",
+                "message": f"setup message {t} about {rng.choice(_TOPICS)}"
+            })
+    return sessions
+
+
+def _request(scenario, client, session, rng, n):
+    user_id, persona_id = session
+    if scenario == "send_message":
+        return client.post("/send_message", json={
+            "session_id": user_id, "persona_id": persona_id, "persona_instructions": "",
+            "message": f"message {n}: what do you think about {rng.choice(_TOPICS)}?"
+        })
+    if scenario == "suggest":
+        return client.post("/suggest", json={"session_id": user_id, "persona_id": persona_id})
+    if scenario == "get_history":
+        return client.get("/get_history", params={"session_id": user_id, "persona_id": persona_id, "limit": 50})
+    if scenario == "list_personas":
+        return client.get("/list_personas", params={"user_id": user_id})
+    raise ValueError(scenario)
+
+
+async def _run_level(client, scenario, sessions, concurrency, requests, timer, seed):
+    rng = random.Random(seed)
+    plan = [(rng.choice(sessions), n) for n in range(requests)]
+    latencies = []
+    errors = 0
+    cursor = iter(plan)
+
+    async def worker():
+        nonlocal errors
+        for session, n in cursor:
+            started = time.perf_counter()
+            try:
+                resp = await _request(scenario, client, session, rng, n)
+                body = resp.json()
+                ok = resp.status_code == 200 and not (isinstance(body, dict) and "error" in body)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    timer.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "stages_ms_per_request": {
+            stage: round(total * 1000 / requests, 2) for stage, (total, _) in sorted(timer.totals.items())
+        }
+    }
+
+
+async def run(args):
+    import httpx
+    import main
+    from db import client as mongo_client
+    from db import embeddings
+    from services.agent import FakeBackend, parse_latency, set_backend
+    from services.warmup import readiness
+    from bench.memory_mongo import MemoryMongoClient
+
+    # Per-request access logs would drown the report
+    logging.getLogger().setLevel(logging.WARNING)
+    mongo_client._client = MemoryMongoClient(latency=args.mongo_latency)
+    set_backend(FakeBackend(latency=parse_latency(args.llm_latency, seed=args.seed)))
+    if args.embedder == "hash":
+        embeddings._model = HashEmbedder()
+
+    timer = StageTimer()
+    _instrument(timer)
+
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            deadline = time.perf_counter() + 120
+            while not (await readiness())["ready"]:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError("app did not become ready")
+                await asyncio.sleep(0.05)
+
+            sessions = await _setup(client, args.users, args.setup_turns, random.Random(args.seed))
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    result = await _run_level(
+                        client, scenario, sessions, concurrency, args.requests, timer, args.seed
+                    )
+                    results.append(result)
+                    if not args.json:
+                        _print_row(result)
+    return results
+
+
+def _print_header():
+    print(f"{'scenario':14} {'conc':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'err':>4}  stages (ms/request)")
+
+
+def _print_row(r):
+    stages = ", ".join(f"{k} {v}" for k, v in r["stages_ms_per_request"].items())
+    print(f"{r['scenario']:14} {r['concurrency']:>4} {r['throughput_rps']:>8} {r['p50_ms']:>9} "
+          f"{r['p95_ms']:>9} {r['p99_ms']:>9} {r['errors']:>4}  {stages}")
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions against a saved baseline"""
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        base = previous.get((r["scenario"], r["concurrency"]))
+        if base is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if r[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{r['scenario']}@{r['concurrency']}: {metric} {base[metric]} -> {r[metric]}")
+        if r["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{r['scenario']}@{r['concurrency']}: throughput_rps {base['throughput_rps']} -> {r['throughput_rps']}"
+            )
+        if r["errors"] > base["errors"]:
+            regressions.append(f"{r['scenario']}@{r['concurrency']}: errors {base['errors']} -> {r['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline API load test with stand-in backends")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency level")
+    parser.add_argument("--users", type=int, default=20, help="conversations set up before the run")
+    parser.add_argument("--setup-turns", type=int, default=10, help="messages sent per conversation during setup")
+    parser.add_argument("--llm-latency", default="lognormal:0.3,0.4",
+                        help='fake LLM latency in seconds: "0.2", "uniform:a,b", "normal:mean,sd", "lognormal:median,sigma"')
+    parser.add_argument("--mongo-latency", type=float, default=0.0005, help="seconds per stand-in Mongo operation")
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="fail if results regress against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    chroma_dir = tempfile.mkdtemp(prefix="rizzy-bench-chroma-")
+    # Configuration is read at import time, so it has to be in place before the app loads
+    os.environ["CHROMA_PATH"] = chroma_dir
+    os.environ["LLM_BACKEND"] = "fake"
+    # Offline: no Chroma telemetry calls (and retry noise) to posthog
+    os.environ["ANONYMIZED_TELEMETRY"] = "False"
+    os.environ.setdefault("PRECOMPUTE_RECOMMENDATIONS", "false")
+    # The per-user limiter stays on: the burst covers every request the plan
+    # sends, so only LLM calls charged beyond one per request show up as errors
+    os.environ.setdefault("LLM_USER_BURST", str(_requests_per_user(args)))
+    sys.path.insert(0, BACKEND_DIR)
+
+    if not args.json:
+        _print_header()
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(chroma_dir, ignore_errors=True)
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "save_baseline", "baseline")},
+        "results": results
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}", file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print("No regressions against baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""In-memory stand-in for pymongo's AsyncMongoClient, for benchmarks.
+
+Implements the subset of the collection API the db/ modules use (find,
+find_one, insert_one, update_one, find_one_and_update, bulk_write of
+UpdateOne, delete_one/delete_many, count_documents, create_index) and the
+query/update operators they rely on. Each operation can sleep for a fixed
+`latency` to stand in for the network round trip to a real server.
+
+Install it before the app starts:
+
+    from db import client
+    client._client = MemoryMongoClient(latency=0.0005)
+"""
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from types import SimpleNamespace
+import asyncio
+import copy
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+def _set(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset(doc, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _sort_key(doc, path):
+    # Missing values sort first, as in Mongo
+    value, _ = _get(doc, path)
+    return (value is not None, value)
+
+
+def _compare(value, op, arg, exists):
+    if op == "$exists":
+        return exists == bool(arg)
+    if op == "$eq":
+        return value == arg
+    if op == "$ne":
+        return value != arg
+    if op == "$in":
+        return value in arg
+    if op == "$nin":
+        return value not in arg
+    if not exists or value is None:
+        return False
+    if op == "$gt":
+        return value > arg
+    if op == "$gte":
+        return value >= arg
+    if op == "$lt":
+        return value < arg
+    if op == "$lte":
+        return value <= arg
+    raise NotImplementedError(f"query operator {op}")
+
+
+def _matches(doc, query):
+    for path, cond in (query or {}).items():
+        value, exists = _get(doc, path)
+        if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            if not all(_compare(value, op, arg, exists) for op, arg in cond.items()):
+                return False
+        elif isinstance(value, list) and not isinstance(cond, list):
+            if cond not in value:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if doc is None:
+        return None
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    include = [k for k, v in projection.items() if v and k != "_id"]
+    if include:
+        out = {}
+        if projection.get("_id", 1):
+            out["_id"] = doc.get("_id")
+        for path in include:
+            value, exists = _get(doc, path)
+            if exists:
+                _set(out, path, value)
+        return out
+    for path, v in projection.items():
+        if not v:
+            _unset(doc, path)
+    return doc
+
+
+def _apply_update(doc, update, inserting):
+    for op, fields in update.items():
+        if op == "$set":
+            for path, value in fields.items():
+                _set(doc, path, copy.deepcopy(value))
+        elif op == "$setOnInsert":
+            if inserting:
+                for path, value in fields.items():
+                    _set(doc, path, copy.deepcopy(value))
+        elif op == "$unset":
+            for path in fields:
+                _unset(doc, path)
+        elif op == "$inc":
+            for path, amount in fields.items():
+                value, _ = _get(doc, path)
+                _set(doc, path, (value or 0) + amount)
+        elif op == "$push":
+            for path, spec in fields.items():
+                current, _ = _get(doc, path)
+                items = list(current or [])
+                if isinstance(spec, dict) and "$each" in spec:
+                    items.extend(copy.deepcopy(spec["$each"]))
+                    for key, direction in (spec.get("$sort") or {}).items():
+                        items.sort(key=lambda item: _sort_key(item, key), reverse=direction < 0)
+                else:
+                    items.append(copy.deepcopy(spec))
+                _set(doc, path, items)
+        else:
+            raise NotImplementedError(f"update operator {op}")
+
+
+class MemoryCursor:
+    def __init__(self, docs, projection):
+        self._docs = docs
+        self._projection = projection
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        keys = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        for key, d in reversed(keys):
+            self._docs.sort(key=lambda doc: _sort_key(doc, key), reverse=d < 0)
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def _results(self):
+        docs = self._docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [_project(d, self._projection) for d in docs]
+
+    async def to_list(self, length=None):
+        results = self._results()
+        return results[:length] if length else results
+
+    async def __aiter__(self):
+        for doc in self._results():
+            yield doc
+
+
+class MemoryCollection:
+    def __init__(self, latency):
+        self._docs = {}
+        self._unique = []
+        self._latency = latency
+
+    async def _roundtrip(self):
+        # Yield like real I/O would, so concurrent requests interleave
+        await asyncio.sleep(self._latency)
+
+    def _find(self, query):
+        return [d for d in self._docs.values() if _matches(d, query)]
+
+    def _check_unique(self, doc, ignore_id=None):
+        for keys in self._unique:
+            key = tuple(_get(doc, k)[0] for k in keys)
+            for other in self._docs.values():
+                if other["_id"] != ignore_id and tuple(_get(other, k)[0] for k in keys) == key:
+                    raise DuplicateKeyError(f"duplicate key {dict(zip(keys, key))}")
+
+    def _insert(self, doc):
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self._docs:
+            raise DuplicateKeyError(f"duplicate _id {doc['_id']}")
+        self._check_unique(doc)
+        self._docs[doc["_id"]] = doc
+        return doc
+
+    def _update(self, query, update, upsert):
+        matches = self._find(query)
+        if matches:
+            doc = matches[0]
+            updated = copy.deepcopy(doc)
+            _apply_update(updated, update, inserting=False)
+            self._check_unique(updated, ignore_id=doc["_id"])
+            self._docs[doc["_id"]] = updated
+            return doc, updated, None
+        if not upsert:
+            return None, None, None
+        seed = {
+            k: copy.deepcopy(v) for k, v in query.items()
+            if not k.startswith("$") and not (isinstance(v, dict) and any(x.startswith("$") for x in v))
+        }
+        _apply_update(seed, update, inserting=True)
+        inserted = self._insert(seed)
+        return None, inserted, inserted["_id"]
+
+    async def create_index(self, keys, unique=False, **kwargs):
+        await self._roundtrip()
+        names = [keys] if isinstance(keys, str) else [k for k, _ in keys]
+        if unique:
+            self._unique.append(names)
+        return "_".join(names)
+
+    def find(self, filter=None, projection=None):
+        return MemoryCursor(self._find(filter), projection)
+
+    async def find_one(self, filter=None, projection=None):
+        await self._roundtrip()
+        matches = self._find(filter)
+        return _project(matches[0], projection) if matches else None
+
+    async def count_documents(self, filter):
+        await self._roundtrip()
+        return len(self._find(filter))
+
+    async def insert_one(self, doc):
+        await self._roundtrip()
+        stored = self._insert(copy.deepcopy(doc))
+        doc.setdefault("_id", stored["_id"])
+        return SimpleNamespace(inserted_id=stored["_id"])
+
+    async def update_one(self, filter, update, upsert=False):
+        await self._roundtrip()
+        before, _, upserted_id = self._update(filter, update, upsert)
+        matched = int(before is not None)
+        return SimpleNamespace(matched_count=matched, modified_count=matched, upserted_id=upserted_id)
+
+    async def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE):
+        await self._roundtrip()
+        before, after, _ = self._update(filter, update, upsert)
+        return _project(after if return_document == ReturnDocument.AFTER else before, projection)
+
+    async def bulk_write(self, requests, ordered=True):
+        await self._roundtrip()
+        for op in requests:
+            # pymongo.UpdateOne keeps its arguments in these slots
+            self._update(op._filter, op._doc, op._upsert)
+        return SimpleNamespace(acknowledged=True)
+
+    async def delete_one(self, filter):
+        await self._roundtrip()
+        matches = self._find(filter)
+        if matches:
+            del self._docs[matches[0]["_id"]]
+        return SimpleNamespace(deleted_count=len(matches[:1]))
+
+    async def delete_many(self, filter):
+        await self._roundtrip()
+        matches = self._find(filter)
+        for doc in matches:
+            del self._docs[doc["_id"]]
+        return SimpleNamespace(deleted_count=len(matches))
+
+
+class MemoryDatabase:
+    def __init__(self, latency):
+        self._latency = latency
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self._latency)
+        return self._collections[name]
+
+    async def command(self, name, *args, **kwargs):
+        await asyncio.sleep(self._latency)
+        return {"ok": 1.0}
+
+
+class MemoryMongoClient:
+    def __init__(self, latency=0.0):
+        self._latency = latency
+        self._databases = {}
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(self._latency)
+        return self._databases[name]
+
+    async def close(self):
+        pass
@@ -0,0 +1,121 @@
+"""Cold start benchmark.
+
+Measures, over several fresh processes:
+  - import time of the app module (`import main`)
+  - time from spawning uvicorn until /healthz answers (process up)
+  - time from spawning uvicorn until /readyz answers 200 (models loaded)
+
+Run from the backend directory:
+
+    python -m bench.startup [--runs 3] [--json]
+
+Set LLM_BACKEND=fake to keep the Gemini client out of the measurement.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import():
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def measure_ready(timeout):
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR
+    )
+    healthy = ready = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if healthy is None and _status(f"{base}/healthz") == 200:
+                healthy = time.perf_counter() - started
+            if healthy is not None and _status(f"{base}/readyz") == 200:
+                ready = time.perf_counter() - started
+                break
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+            time.sleep(0.05)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return healthy, ready
+
+
+def _summary(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {
+        "median": round(statistics.median(values), 3),
+        "min": round(min(values), 3),
+        "max": round(max(values), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time-to-ready")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for /readyz")
+    parser.add_argument("--json", action="store_true", help="print machine readable results")
+    args = parser.parse_args()
+
+    imports, healthy, ready = [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import())
+        h, r = measure_ready(args.timeout)
+        healthy.append(h)
+        ready.append(r)
+
+    results = {
+        "runs": args.runs,
+        "import_seconds": _summary(imports),
+        "time_to_healthy_seconds": _summary(healthy),
+        "time_to_ready_seconds": _summary(ready)
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, stats in results.items():
+        if name == "runs":
+            continue
+        if stats is None:
+            print(f"{name:26} did not finish")
+        else:
+            print(f"{name:26} median {stats['median']:.3f}s  (min {stats['min']:.3f}s, max {stats['max']:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
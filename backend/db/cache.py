@@ -0,0 +1,95 @@
+from collections import OrderedDict
+import asyncio
+import threading
+import time
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Keeps hit/miss/eviction counters so callers can report a hit rate.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """Current value without counting a hit or miss or refreshing its LRU position"""
+        with self._lock:
+            item = self._data.get(key)
+            return item[0] if item and item[1] >= time.monotonic() else None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+async def single_flight(inflight, key, compute):
+    """Await compute() once for all concurrent callers with the same key.
+
+    inflight maps keys to running tasks. The work runs as its own task, so a
+    caller that is cancelled (e.g. its client disconnected) only stops
+    waiting; the other callers still get the result.
+    """
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(compute())
+        inflight[key] = task
+        task.add_done_callback(lambda t: _flight_done(inflight, key, t))
+    return await asyncio.shield(task)
+
+
+def _flight_done(inflight, key, task):
+    if inflight.get(key) is task:
+        del inflight[key]
+    if not task.cancelled():
+        # Everyone may have stopped waiting; don't let the loop warn about it
+        task.exception()
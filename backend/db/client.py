@@ -0,0 +1,38 @@
+from pymongo import AsyncMongoClient
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB = os.getenv("MONGO_DB", "chat_db")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))
+
+# The one Mongo client (and connection pool) shared by every db/* module
+_client = None
+
+
+def init_mongo():
+    """Create the shared client. Called from the app lifespan; scripts get it lazily."""
+    global _client
+    if _client is None:
+        _client = AsyncMongoClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=MONGO_TIMEOUT_MS
+        )
+    return _client
+
+
+async def close_mongo():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def get_db():
+    return init_mongo()[MONGO_DB]
@@ -0,0 +1,239 @@
+"""Shared embedding sidecar.
+
+Loads the embedding model once per box and serves encode requests from every
+uvicorn worker over a Unix socket, so workers no longer each hold a copy of
+the model and its runtime. Start it next to the app:
+
+    python -m db.embedding_server [--socket /tmp/rizzy-embed.sock] [--backend onnx]
+
+and point the workers at it with EMBEDDING_SOCKET. Requests arriving within
+EMBEDDING_BATCH_WINDOW_MS of each other, from any worker, share a model call.
+
+Wire format (big-endian lengths, vectors as little-endian float32):
+
+    request   u32 count, then count x (u32 byte length, utf-8 text)
+    response  u8 status 0, u32 rows, u32 dim, rows * dim float32
+              u8 status 1, u32 byte length, utf-8 error message
+"""
+from db.embeddings import EMBEDDING_BACKEND, EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_MAX_BATCH, load_model
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import logging
+import numpy as np
+import os
+import signal
+import socket
+import struct
+import threading
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_SOCKET_TIMEOUT = float(os.getenv("EMBEDDING_SOCKET_TIMEOUT", "30"))
+DEFAULT_SOCKET = "/tmp/rizzy-embed.sock"
+
+_U32 = struct.Struct(">I")
+_SHAPE = struct.Struct(">II")
+_VECTOR = np.dtype("<f4")
+OK, ERROR = 0, 1
+
+
+def encode_request(texts):
+    parts = [_U32.pack(len(texts))]
+    for text in texts:
+        data = text.encode("utf-8")
+        parts.append(_U32.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def encode_vectors(vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=_VECTOR)
+    if vectors.ndim != 2:
+        vectors = vectors.reshape(len(vectors), -1)
+    return bytes([OK]) + _SHAPE.pack(*vectors.shape) + vectors.tobytes()
+
+
+def encode_error(message):
+    data = message.encode("utf-8")
+    return bytes([ERROR]) + _U32.pack(len(data)) + data
+
+
+# ---------------------------------------------------------------- server
+
+_queue = None
+_model = None
+
+
+async def _read_request(reader):
+    (count,) = _U32.unpack(await reader.readexactly(4))
+    texts = []
+    for _ in range(count):
+        (size,) = _U32.unpack(await reader.readexactly(4))
+        texts.append((await reader.readexactly(size)).decode("utf-8"))
+    return texts
+
+
+async def _batch_loop():
+    """Coalesce queued requests into one model call per window"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _queue.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + EMBEDDING_BATCH_WINDOW_MS / 1000
+        while size < EMBEDDING_MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            size += len(item[0])
+
+        texts = [text for item_texts, _ in batch for text in item_texts]
+        try:
+            encoded = await asyncio.to_thread(lambda: np.asarray(_model.encode(texts), dtype=_VECTOR))
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+
+        start = 0
+        for item_texts, fut in batch:
+            if not fut.done():
+                fut.set_result(encoded[start:start + len(item_texts)])
+            start += len(item_texts)
+
+
+async def _handle(reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                texts = await _read_request(reader)
+            except asyncio.IncompleteReadError:
+                break
+            if not texts:
+                writer.write(encode_vectors(np.zeros((0, 0), dtype=_VECTOR)))
+            else:
+                fut = loop.create_future()
+                await _queue.put((texts, fut))
+                try:
+                    writer.write(encode_vectors(await fut))
+                except Exception as e:
+                    writer.write(encode_error(str(e)))
+            await writer.drain()
+    except (ConnectionError, UnicodeDecodeError) as e:
+        logger.warning("Embedding client dropped: %s", e)
+    except asyncio.CancelledError:
+        pass  # server shutting down
+    finally:
+        writer.close()
+
+
+async def serve(path=DEFAULT_SOCKET, backend=EMBEDDING_BACKEND):
+    global _queue, _model
+    _model = await asyncio.to_thread(load_model, backend)
+    _model.encode(["warmup"])
+    _queue = asyncio.Queue()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(_handle, path=path)
+    batcher = asyncio.create_task(_batch_loop())
+    # Stop cleanly on SIGTERM too, so the socket file gets removed
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    print(f"Embedding server ({backend}) listening on {path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        batcher.cancel()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+# ---------------------------------------------------------------- client
+
+def _recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while size:
+        n = sock.recv_into(view[-size:], size)
+        if n == 0:
+            raise ConnectionError("embedding server closed the connection")
+        size -= n
+    return bytes(buf)
+
+
+class RemoteEmbedder:
+    """Drop-in for the in-process model: encode(list[str]) -> (n, dim) array.
+
+    Keeps one connection per thread, since encode() runs on worker threads.
+    """
+
+    def __init__(self, path, timeout=EMBEDDING_SOCKET_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _roundtrip(self, payload):
+        sock = getattr(self._local, "sock", None) or self._connect()
+        sock.sendall(payload)
+        status = _recv_exactly(sock, 1)[0]
+        if status == ERROR:
+            (size,) = _U32.unpack(_recv_exactly(sock, 4))
+            raise RuntimeError(f"embedding server: {_recv_exactly(sock, size).decode('utf-8')}")
+        rows, dim = _SHAPE.unpack(_recv_exactly(sock, _SHAPE.size))
+        data = _recv_exactly(sock, rows * dim * _VECTOR.itemsize)
+        return np.frombuffer(data, dtype=_VECTOR).reshape(rows, dim)
+
+    def encode(self, texts):
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        payload = encode_request(list(texts))
+        try:
+            return self._roundtrip(payload)
+        except (ConnectionError, BrokenPipeError):
+            # The server restarted since this thread last connected, retry once
+            self._close()
+            return self._roundtrip(payload)
+        except Exception:
+            # Don't reuse a connection that may be mid-frame
+            self._close()
+            raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve embeddings to local workers over a Unix socket")
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SOCKET") or DEFAULT_SOCKET)
+    parser.add_argument("--backend", default=EMBEDDING_BACKEND, help="torch | onnx | onnx-int8")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.socket, args.backend))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+from dotenv import load_dotenv
+from db.cache import TTLCache
+import asyncio
+import hashlib
+import os
+import threading
+
+load_dotenv()
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# "torch" (SentenceTransformer), "onnx" or "onnx-int8" (ONNX Runtime, see db/onnx_embedder.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# How long embed() waits for other requests to join a batch
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "64"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+# Unix socket of a shared embedding server (python -m db.embedding_server); unset = load in-process
+EMBEDDING_SOCKET = os.getenv("EMBEDDING_SOCKET")
+
+# Loading the model is slow (torch or onnxruntime), so it only happens on first use or warmup
+_model = None
+_model_lock = threading.Lock()
+
+# Embeddings never go stale, so entries only leave the cache through LRU eviction
+embedding_cache = TTLCache(maxsize=EMBEDDING_CACHE_SIZE, ttl=float("inf"))
+
+
+def load_model(backend=EMBEDDING_BACKEND):
+    """Build an embedder exposing encode(list[str]) -> (n, dim) array"""
+    if backend in ("onnx", "onnx-int8"):
+        from db.onnx_embedder import OnnxEmbedder
+        return OnnxEmbedder(quantized=backend == "onnx-int8")
+    if backend != "torch":
+        raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                if EMBEDDING_SOCKET:
+                    from db.embedding_server import RemoteEmbedder
+                    _model = RemoteEmbedder(EMBEDDING_SOCKET)
+                else:
+                    _model = load_model()
+    return _model
+
+
+def model_loaded():
+    return _model is not None
+
+
+def _key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def encode(texts):
+    """Embed a list of texts synchronously, reusing cached vectors.
+
+    All cache misses go to the model in a single batch.
+    """
+    keys = [_key(t) for t in texts]
+    vectors = [embedding_cache.get(k) for k in keys]
+    missing = {}
+    for key, text, vec in zip(keys, texts, vectors):
+        if vec is None:
+            missing.setdefault(key, text)
+
+    if missing:
+        encoded = get_model().encode(list(missing.values()))
+        fresh = {}
+        for key, vec in zip(missing, encoded):
+            fresh[key] = vec.tolist()
+            embedding_cache.set(key, fresh[key])
+        vectors = [fresh[k] if v is None else v for k, v in zip(keys, vectors)]
+    return vectors
+
+
+def embed_sync(text):
+    return encode([text])[0]
+
+
+_pending = {}
+_flush_handle = None
+
+
+def _schedule_flush(loop):
+    global _flush_handle
+    if len(_pending) >= EMBEDDING_MAX_BATCH:
+        if _flush_handle is not None:
+            _flush_handle.cancel()
+        _flush_handle = None
+        loop.create_task(_flush())
+    elif _flush_handle is None:
+        _flush_handle = loop.call_later(
+            EMBEDDING_BATCH_WINDOW_MS / 1000, lambda: loop.create_task(_flush())
+        )
+
+
+async def _flush():
+    global _flush_handle, _pending
+    _flush_handle = None
+    batch, _pending = _pending, {}
+    if not batch:
+        return
+
+    texts = [text for text, _ in batch.values()]
+    try:
+        # The model is CPU bound, keep it off the event loop
+        encoded = await asyncio.to_thread(lambda: get_model().encode(texts))
+    except Exception as e:
+        for _, futures in batch.values():
+            for fut in futures:
+                if not fut.done():
+                    fut.set_exception(e)
+        return
+
+    for (key, (_, futures)), vec in zip(batch.items(), encoded):
+        vec = vec.tolist()
+        embedding_cache.set(key, vec)
+        for fut in futures:
+            if not fut.done():
+                fut.set_result(vec)
+
+
+async def embed(text):
+    """Embed one text without blocking the event loop.
+
+    Requests arriving within EMBEDDING_BATCH_WINDOW_MS of each other (from any
+    session) are coalesced into one model call; identical texts share a result.
+    """
+    key = _key(text)
+    cached = embedding_cache.get(key)
+    if cached is not None:
+        return cached
+
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    if key in _pending:
+        _pending[key][1].append(fut)
+    else:
+        _pending[key] = (text, [fut])
+        _schedule_flush(loop)
+    return await fut
+
+
+def embedding_cache_stats():
+    return embedding_cache.stats()
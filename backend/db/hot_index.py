@@ -0,0 +1,194 @@
+"""In-process hot tier for conversation memories, in front of Chroma.
+
+Recently queried conversations keep their memory embeddings in one
+contiguous float32 matrix each, so a top-k lookup is a single matrix-vector
+product instead of a trip through Chroma's SQLite layer and HNSW index.
+Results are exact and ranked by squared L2 distance, Chroma's default
+metric.
+
+A conversation is loaded from Chroma the first time it is queried and kept
+up to date by upsert_vectors() afterwards. Conversations are evicted least
+recently used once HOT_INDEX_MAX_BYTES is exceeded; ones with more than
+HOT_INDEX_MAX_ROWS memories are left to Chroma.
+"""
+from collections import OrderedDict
+from db.cache import TTLCache
+from dotenv import load_dotenv
+import numpy as np
+import os
+import threading
+
+load_dotenv()
+
+# "auto": on unless the vector store is shared with other processes
+HOT_INDEX_ENABLED = os.getenv("HOT_INDEX_ENABLED", "auto").lower()
+HOT_INDEX_MAX_BYTES = int(os.getenv("HOT_INDEX_MAX_BYTES", str(256 * 1024 * 1024)))
+HOT_INDEX_MAX_ROWS = int(os.getenv("HOT_INDEX_MAX_ROWS", "5000"))
+
+
+class _Conversation:
+    """Memories of one conversation: row-aligned ids, documents and vectors"""
+
+    def __init__(self, dim):
+        self.ids = []
+        self.documents = []
+        self.rows = {}
+        self.matrix = np.empty((0, dim), dtype=np.float32)
+        self.norms = np.empty(0, dtype=np.float32)
+        self.doc_bytes = 0
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.norms.nbytes + self.doc_bytes
+
+    def _grow(self, needed):
+        capacity = max(16, len(self.matrix))
+        while capacity < needed:
+            capacity *= 2
+        if capacity > len(self.matrix):
+            matrix = np.empty((capacity, self.matrix.shape[1]), dtype=np.float32)
+            matrix[:len(self.ids)] = self.matrix[:len(self.ids)]
+            norms = np.empty(capacity, dtype=np.float32)
+            norms[:len(self.ids)] = self.norms[:len(self.ids)]
+            self.matrix, self.norms = matrix, norms
+
+    def upsert(self, ids, embeddings, documents):
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        self._grow(len(self.ids) + len(ids))
+        for memory_id, vec, doc in zip(ids, vectors, documents):
+            row = self.rows.get(memory_id)
+            if row is None:
+                row = len(self.ids)
+                self.rows[memory_id] = row
+                self.ids.append(memory_id)
+                self.documents.append(doc)
+            else:
+                self.doc_bytes -= len(self.documents[row])
+                self.documents[row] = doc
+            self.doc_bytes += len(doc)
+            self.matrix[row] = vec
+            self.norms[row] = vec @ vec
+
+    def query(self, query_embedding, top_k):
+        n = len(self.ids)
+        if n == 0:
+            return []
+        q = np.asarray(query_embedding, dtype=np.float32)
+        # |x - q|^2 without the constant |q|^2 term
+        distances = self.norms[:n] - 2.0 * (self.matrix[:n] @ q)
+        k = min(top_k, n)
+        top = np.argpartition(distances, k - 1)[:k] if k < n else np.arange(n)
+        top = top[np.argsort(distances[top], kind="stable")]
+        return [self.documents[i] for i in top]
+
+
+class HotIndex:
+    def __init__(self, max_bytes=HOT_INDEX_MAX_BYTES, max_rows=HOT_INDEX_MAX_ROWS):
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self._entries = OrderedDict()
+        # key -> upserts that arrived while the key was being loaded (None: dropped meanwhile)
+        self._loading = {}
+        # Conversations too large for the hot tier, re-checked now and then
+        self._cold = TTLCache(maxsize=10000, ttl=600)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._stats = {"hits": 0, "loads": 0, "fallbacks": 0, "evictions": 0}
+
+    def query(self, key, query_embedding, top_k, loader):
+        """Top-k documents for key, or None if the caller should ask Chroma.
+
+        loader(key) returns the conversation's (ids, embeddings, documents)
+        from Chroma, or None when it holds more than max_rows memories.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry.query(query_embedding, top_k)
+            if self._cold.get(key) is not None or key in self._loading:
+                self._stats["fallbacks"] += 1
+                return None
+            self._loading[key] = []
+
+        # Read Chroma outside the lock; upserts meanwhile are replayed below
+        try:
+            loaded = loader(key)
+        except Exception:
+            with self._lock:
+                self._loading.pop(key, None)
+            raise
+
+        with self._lock:
+            pending = self._loading.pop(key, None)
+            if pending is None:
+                # Deleted while loading; what was read is stale
+                self._stats["fallbacks"] += 1
+                return None
+            if loaded is None:
+                self._cold.set(key, True)
+                self._stats["fallbacks"] += 1
+                return None
+            ids, embeddings, documents = loaded
+            entry = _Conversation(len(query_embedding))
+            if ids:
+                entry.upsert(ids, embeddings, documents)
+            for batch in pending:
+                entry.upsert(*batch)
+            self._stats["loads"] += 1
+            self._put(key, entry)
+            return entry.query(query_embedding, top_k)
+
+    def upsert(self, key, ids, embeddings, documents):
+        """Apply memories just written to Chroma, if key is hot (or loading)"""
+        with self._lock:
+            if key in self._loading:
+                if self._loading[key] is not None:
+                    self._loading[key].append((list(ids), list(embeddings), list(documents)))
+                return
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            self._bytes -= entry.nbytes
+            entry.upsert(ids, embeddings, documents)
+            if len(entry.ids) > self.max_rows:
+                # Grew too large; Chroma serves it from now on
+                self._cold.set(key, True)
+                return
+            self._put(key, entry)
+
+    def drop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.nbytes
+            self._cold.pop(key)
+            if key in self._loading:
+                # A load in flight may have read the old contents; don't keep its result
+                self._loading[key] = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._cold.clear()
+            self._bytes = 0
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._bytes += entry.nbytes
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "conversations": len(self._entries), "bytes": self._bytes}
+
+
+hot_index = HotIndex()
+
+
+def hot_index_stats():
+    return hot_index.stats()
@@ -0,0 +1,47 @@
+"""Move legacy `conversations.messages` arrays into message buckets.
+
+Run from the backend directory:
+
+    python -m db.migrate_buckets [--dry-run]
+
+Conversations are also migrated lazily on first access, so this can run
+while the app is serving traffic.
+"""
+from db.client import close_mongo, get_db
+from db.mongo import ensure_indexes, migrate_conversation
+import argparse
+import asyncio
+
+
+async def run(dry_run):
+    await ensure_indexes()
+    legacy = get_db()["conversations"].find(
+        {"messages": {"$exists": True}},
+        {"session_id": 1, "persona_id": 1}
+    )
+
+    conversations = 0
+    messages = 0
+    async for convo in legacy:
+        conversations += 1
+        if not dry_run:
+            messages += await migrate_conversation(convo["session_id"], convo["persona_id"])
+    await close_mongo()
+    return conversations, messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only count legacy conversations")
+    args = parser.parse_args()
+
+    conversations, messages = asyncio.run(run(args.dry_run))
+
+    if args.dry_run:
+        print(f"{conversations} conversations still use the legacy layout")
+    else:
+        print(f"Migrated {conversations} conversations ({messages} messages)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Split the legacy chat_memory collection into per-conversation partitions.
+
+Run from the backend directory (with the target VECTOR_PARTITION_MODE set):
+
+    python -m db.migrate_vector_partitions [--batch-size 500] [--drop-source]
+
+Memories keep their ids and embeddings, so re-running is safe. Pass
+--drop-source to delete chat_memory once everything has been copied.
+"""
+from db.vector_store import LEGACY_COLLECTION, VECTOR_PARTITION_MODE, ChromaStore, get_store, session_persona
+import argparse
+
+
+def _owner(meta):
+    session_persona = meta.get("session_persona", "")
+    if "::" in session_persona:
+        return tuple(session_persona.split("::", 1))
+    # Early memories stored the ids as separate fields
+    if meta.get("session_id") and meta.get("persona_id"):
+        return meta["session_id"], meta["persona_id"]
+    return None
+
+
+def migrate(batch_size=500, drop_source=False):
+    if VECTOR_PARTITION_MODE == "global":
+        print("VECTOR_PARTITION_MODE=global uses chat_memory directly, nothing to migrate")
+        return 0
+    store = get_store()
+    if not isinstance(store, ChromaStore):
+        print("VECTOR_STORE is not a Chroma store, nothing to migrate")
+        return 0
+
+    chroma_client = store.client
+    source = chroma_client.get_or_create_collection(LEGACY_COLLECTION)
+    total = source.count()
+    moved = 0
+    for offset in range(0, total, batch_size):
+        page = source.get(
+            limit=batch_size,
+            offset=offset,
+            include=["documents", "embeddings", "metadatas"]
+        )
+        by_collection = {}
+        for doc_id, doc, emb, meta in zip(page["ids"], page["documents"], page["embeddings"], page["metadatas"]):
+            owner = _owner(meta or {})
+            if owner is None:
+                print(f"Skipping {doc_id}: metadata does not name a session and persona")
+                continue
+            session_id, persona_id = owner
+            group = by_collection.setdefault(store.collection_name((session_id, persona_id)), {
+                "ids": [], "documents": [], "embeddings": [], "metadatas": []
+            })
+            group["ids"].append(doc_id)
+            group["documents"].append(doc)
+            group["embeddings"].append(list(emb))
+            # Shard collections are filtered on session_persona, which early
+            # memories don't carry; without it they would never match a query
+            group["metadatas"].append({**meta, "session_persona": session_persona(session_id, persona_id)})
+
+        for name, group in by_collection.items():
+            store.get_collection(name).upsert(**group)
+            moved += len(group["ids"])
+        print(f"Copied {min(offset + batch_size, total)}/{total}")
+
+    if drop_source:
+        if moved == total:
+            chroma_client.delete_collection(LEGACY_COLLECTION)
+            print(f"Dropped {LEGACY_COLLECTION}")
+        else:
+            print(f"Kept {LEGACY_COLLECTION}: {total - moved} memories could not be routed")
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--drop-source", action="store_true", help=f"delete {LEGACY_COLLECTION} afterwards")
+    args = parser.parse_args()
+    moved = migrate(args.batch_size, args.drop_source)
+    print(f"Migrated {moved} memories")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,278 @@
-from pymongo import MongoClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
 from dotenv import load_dotenv
-import os 
+from datetime import datetime, timedelta, timezone
+from db.client import get_db
+import asyncio
+import logging
+import os
 
 load_dotenv()
 
-mongo_client = MongoClient(os.getenv("MONGO_URI"))
-db = mongo_client["chat_db"]
-convos = db["conversations"]
+logger = logging.getLogger(__name__)
 
+# Messages per bucket; message `seq` lives in bucket seq // MESSAGE_BUCKET_SIZE
+MESSAGE_BUCKET_SIZE = int(os.getenv("MESSAGE_BUCKET_SIZE", "100"))
+# A legacy migration claimed longer ago than this is presumed dead and may be taken over
+MIGRATION_CLAIM_SECONDS = float(os.getenv("MIGRATION_CLAIM_SECONDS", "60"))
+MIGRATION_POLL_MS = float(os.getenv("MIGRATION_POLL_MS", "50"))
 
-def get_messages(session_id, persona_id):
-    convo = convos.find_one({"session_id": session_id, "persona_id": persona_id})
-    return convo.get("messages", []) if convo else []
 
-def save_message(session_id, persona_id, role, content):
-    convos.update_one(
-        {"session_id": session_id, "persona_id": persona_id},
-        {"$push": {"messages": {"role": role, "content": content}}},
-        upsert=True
+def _convos():
+    # One small head document per conversation: summary + message_count
+    return get_db()["conversations"]
+
+def _buckets():
+    # Messages live in fixed-size buckets: {session_id, persona_id, bucket, messages, count}
+    return get_db()["message_buckets"]
+
+def _convo_filter(session_id, persona_id):
+    return {"session_id": session_id, "persona_id": persona_id}
+
+async def _ensure_migrated(head, session_id, persona_id):
+    """Move a legacy conversation into buckets, or wait for whoever is moving it"""
+    # Heads written before bucketing have no message_count, only a messages array
+    while head is not None and "message_count" not in head:
+        await migrate_conversation(session_id, persona_id)
+        head = await _convos().find_one(_convo_filter(session_id, persona_id), {"message_count": 1})
+        if head is not None and "message_count" not in head:
+            # Another caller holds the claim
+            await asyncio.sleep(MIGRATION_POLL_MS / 1000)
+
+async def _read_buckets(session_id, persona_id, max_bucket=None, bucket_limit=0, min_bucket=None, oldest_first=False):
+    query = _convo_filter(session_id, persona_id)
+    if max_bucket is not None or min_bucket is not None:
+        query["bucket"] = {}
+        if max_bucket is not None:
+            query["bucket"]["$lte"] = max_bucket
+        if min_bucket is not None:
+            query["bucket"]["$gte"] = min_bucket
+    cursor = _buckets().find(query, {"_id": 0, "messages": 1}).sort("bucket", 1 if oldest_first else -1)
+    if bucket_limit:
+        cursor = cursor.limit(bucket_limit)
+    messages = [m for b in await cursor.to_list() for m in b.get("messages", [])]
+    messages.sort(key=lambda m: m["seq"])
+    return messages
+
+
+async def get_messages(session_id, persona_id, before=None, limit=None, since=None):
+    """Return messages in seq order, optionally only `limit` messages older than seq `before`
+    and/or only messages from seq `since` onwards.
+
+    With `since`, `limit` keeps the oldest messages from `since` on, so a poller
+    can page forwards without gaps; otherwise it keeps the newest ones.
+    Only the buckets covering the requested page are read.
+    """
+    if before is not None and before <= 0:
+        return []
+    max_bucket = (before - 1) // MESSAGE_BUCKET_SIZE if before is not None else None
+    min_bucket = since // MESSAGE_BUCKET_SIZE if since else None
+    bucket_limit = limit // MESSAGE_BUCKET_SIZE + 2 if limit else 0
+    oldest_first = since is not None
+
+    messages = await _read_buckets(session_id, persona_id, max_bucket, bucket_limit, min_bucket, oldest_first)
+    if not messages:
+        head = await _convos().find_one(_convo_filter(session_id, persona_id), {"message_count": 1})
+        if head is None or "message_count" in head:
+            return []
+        await _ensure_migrated(head, session_id, persona_id)
+        messages = await _read_buckets(session_id, persona_id, max_bucket, bucket_limit, min_bucket, oldest_first)
+
+    if before is not None:
+        messages = [m for m in messages if m["seq"] < before]
+    if since:
+        messages = [m for m in messages if m["seq"] >= since]
+    if limit:
+        messages = messages[:limit] if oldest_first else messages[-limit:]
+    return messages
+
+async def get_conversation_version(session_id, persona_id):
+    """Version of the conversation's message list, read from the head document only.
+
+    Returns {"version", "message_count"}, or None if there is no conversation.
+    The version changes whenever messages are added, and also when the
+    conversation is deleted and started again, since the head's _id is part of it.
+    """
+    head = await _convos().find_one(_convo_filter(session_id, persona_id), {"message_count": 1})
+    if head is None:
+        return None
+    if "message_count" not in head:
+        await _ensure_migrated(head, session_id, persona_id)
+        return await get_conversation_version(session_id, persona_id)
+    return {"version": f"{head['_id']}-{head['message_count']}", "message_count": head["message_count"]}
+
+async def ensure_indexes():
+    """Create the indexes the conversation queries rely on"""
+    try:
+        # Unique, so two first messages racing to create the head can't both win
+        await _convos().create_index([("session_id", 1), ("persona_id", 1)], unique=True)
+    except OperationFailure as e:
+        logger.warning("Unique conversations index not created, falling back to a plain one: %s", e)
+        await _convos().create_index([("session_id", 1), ("persona_id", 1)])
+    await _buckets().create_index([("session_id", 1), ("persona_id", 1), ("bucket", 1)], unique=True)
+
+async def get_recent_context(session_id, persona_id, last_n):
+    """Fetch the last N messages, the summary (and its watermark) and the message count.
+
+    Reads the small head document and only the newest buckets.
+    """
+    head = await _convos().find_one(
+        _convo_filter(session_id, persona_id),
+        {"_id": 0, "summary": 1, "summary_watermark": 1, "message_count": 1}
     )
+    if head is None:
+        return {"messages": [], "summary": None, "summary_watermark": 0, "message_count": 0}
+    if "message_count" not in head:
+        await _ensure_migrated(head, session_id, persona_id)
+        return await get_recent_context(session_id, persona_id, last_n)
 
-def get_summary(session_id, persona_id):
-    convo = convos.find_one({"session_id": session_id, "persona_id": persona_id})
+    return {
+        "messages": await get_messages(session_id, persona_id, limit=last_n) if last_n else [],
+        "summary": head.get("summary"),
+        "summary_watermark": head.get("summary_watermark", 0),
+        "message_count": head["message_count"]
+    }
+
+async def save_messages(session_id, persona_id, messages):
+    """Append several {role, content} messages and return the seq of the first one.
+
+    Sequence numbers are reserved atomically on the head document, then the
+    messages are pushed into their buckets in one bulk write.
+    """
+    query = _convo_filter(session_id, persona_id)
+    while True:
+        # Seqs are only reserved on bucketed heads, so they never collide with legacy ones
+        head = await _convos().find_one_and_update(
+            {**query, "messages": {"$exists": False}},
+            {"$inc": {"message_count": len(messages)}},
+            projection={"message_count": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if head is not None:
+            break
+        if await _convos().find_one(query, {"_id": 1}) is None:
+            # New conversation
+            try:
+                head = await _convos().find_one_and_update(
+                    query,
+                    {"$inc": {"message_count": len(messages)}},
+                    projection={"message_count": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                break
+            except DuplicateKeyError:
+                # A concurrent first message created the head; reserve on it
+                continue
+        # Legacy layout: the old array moves into buckets before anything is
+        # appended; if another caller is moving it, wait for it and re-read the head
+        if not await migrate_conversation(session_id, persona_id):
+            await asyncio.sleep(MIGRATION_POLL_MS / 1000)
+
+    first_seq = head["message_count"] - len(messages)
+    by_bucket = {}
+    for offset, msg in enumerate(messages):
+        seq = first_seq + offset
+        by_bucket.setdefault(seq // MESSAGE_BUCKET_SIZE, []).append({"seq": seq, **msg})
+
+    await _buckets().bulk_write([
+        UpdateOne(
+            {**_convo_filter(session_id, persona_id), "bucket": bucket},
+            {
+                "$push": {"messages": {"$each": items, "$sort": {"seq": 1}}},
+                "$inc": {"count": len(items)}
+            },
+            upsert=True
+        )
+        for bucket, items in by_bucket.items()
+    ], ordered=False)
+    return first_seq
+
+async def save_message(session_id, persona_id, role, content):
+    return await save_messages(session_id, persona_id, [{"role": role, "content": content}])
+
+async def get_summary(session_id, persona_id):
+    convo = await _convos().find_one(_convo_filter(session_id, persona_id), {"summary": 1})
     return convo.get("summary", None) if convo else None
 
-def save_summary(session_id, persona_id, summary):
-    convos.update_one(
-        {"session_id": session_id, "persona_id": persona_id},
-        {"$set": {"summary": summary}},
-        upsert=True
+async def get_summary_state(session_id, persona_id):
+    """Summary, the seq it covers up to (summary_watermark) and the message count"""
+    head = await _convos().find_one(
+        _convo_filter(session_id, persona_id),
+        {"_id": 0, "summary": 1, "summary_watermark": 1, "message_count": 1}
+    ) or {}
+    return {
+        "summary": head.get("summary"),
+        "summary_watermark": head.get("summary_watermark", 0),
+        "message_count": head.get("message_count", 0)
+    }
+
+async def save_summary(session_id, persona_id, summary, watermark=None, expected_watermark=None):
+    """Store the summary, and with watermark the seq it covers up to.
+
+    With expected_watermark the write only applies if no other summariser
+    moved the watermark meanwhile; returns whether it was applied.
+    """
+    update = {"summary": summary}
+    if watermark is not None:
+        update["summary_watermark"] = watermark
+    query = _convo_filter(session_id, persona_id)
+    if expected_watermark is not None:
+        # Conversations summarised before watermarks existed have none stored
+        query["summary_watermark"] = expected_watermark if expected_watermark else {"$in": [0, None]}
+        result = await _convos().update_one(query, {"$set": update})
+        return result.matched_count > 0
+    await _convos().update_one(query, {"$set": update}, upsert=True)
+    return True
+
+
+async def migrate_conversation(session_id, persona_id):
+    """Move a legacy `messages` array from the head document into buckets.
+
+    The caller first claims the conversation atomically, so concurrent callers
+    never migrate it twice; a claim older than MIGRATION_CLAIM_SECONDS is
+    taken over. Returns the number of messages moved, or 0 if there was
+    nothing to move or another caller holds the claim. Safe to re-run.
+    """
+    query = {**_convo_filter(session_id, persona_id), "messages": {"$exists": True}}
+    now = datetime.now(timezone.utc)
+    head = None
+    for claim in ({"$exists": False}, {"$lt": now - timedelta(seconds=MIGRATION_CLAIM_SECONDS)}):
+        head = await _convos().find_one_and_update(
+            {**query, "migrating_since": claim},
+            {"$set": {"migrating_since": now}},
+            projection={"messages": 1}
+        )
+        if head is not None:
+            break
+    if head is None:
+        return 0
+
+    legacy = head.get("messages", [])
+    ops = []
+    for start in range(0, len(legacy), MESSAGE_BUCKET_SIZE):
+        chunk = [
+            {"seq": start + i, "role": m["role"], "content": m["content"]}
+            for i, m in enumerate(legacy[start:start + MESSAGE_BUCKET_SIZE])
+        ]
+        ops.append(UpdateOne(
+            {**_convo_filter(session_id, persona_id), "bucket": start // MESSAGE_BUCKET_SIZE},
+            {"$set": {"messages": chunk, "count": len(chunk)}},
+            upsert=True
+        ))
+    if ops:
+        await _buckets().bulk_write(ops, ordered=False)
+
+    # Nothing reserves seqs while the array is present, so the count is exactly the legacy length
+    await _convos().update_one(
+        {"_id": head["_id"], "migrating_since": now},
+        {"$set": {"message_count": len(legacy)}, "$unset": {"messages": "", "migrating_since": ""}}
     )
+    return len(legacy)
 
 
-def delete_chat_history(session_id, persona_id):
+async def delete_chat_history(session_id, persona_id):
     """Delete all chat history for a specific session and persona"""
-    result = convos.delete_one({"session_id": session_id, "persona_id": persona_id})
-    return result.deleted_count > 0
\ No newline at end of file
+    result = await _convos().delete_one(_convo_filter(session_id, persona_id))
+    bucket_result = await _buckets().delete_many(_convo_filter(session_id, persona_id))
+    return result.deleted_count > 0 or bucket_result.deleted_count > 0
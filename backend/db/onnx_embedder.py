@@ -0,0 +1,69 @@
+"""all-MiniLM-L6-v2 on ONNX Runtime, for CPU-only nodes.
+
+Reproduces the SentenceTransformer pipeline (tokenize, transformer, mean
+pooling, L2 normalisation) without torch. The model directory is produced by
+`python -m db.onnx_export` and holds model.onnx, optionally model-int8.onnx,
+and tokenizer.json.
+"""
+from dotenv import load_dotenv
+import numpy as np
+import os
+
+load_dotenv()
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "./onnx_models/all-MiniLM-L6-v2")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 lets onnxruntime decide
+# Same limit SentenceTransformer applies to all-MiniLM-L6-v2
+ONNX_MAX_SEQ_LENGTH = int(os.getenv("ONNX_MAX_SEQ_LENGTH", "256"))
+
+
+class OnnxEmbedder:
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=False):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_file = "model-int8.onnx" if quantized else "model.onnx"
+        model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"{model_path} not found, run `python -m db.onnx_export` first"
+            )
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=ONNX_MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts, batch_size=32):
+        """Return an (n, dim) float32 array of normalised sentence embeddings"""
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size)[0]
+
+        out = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+            hidden = self.session.run(None, feeds)[0]
+            # Mean pooling over real tokens, then L2 normalise
+            mask = attention_mask[..., None].astype(np.float32)
+            summed = (hidden * mask).sum(axis=1)
+            pooled = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            out.append(pooled / np.clip(norms, 1e-12, None))
+
+        if not out:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(out).astype(np.float32)
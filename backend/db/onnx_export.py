@@ -0,0 +1,75 @@
+"""Export all-MiniLM-L6-v2 to ONNX and optionally quantize it to int8.
+
+Run once, offline, from the backend directory:
+
+    python -m db.onnx_export [--out ./onnx_models/all-MiniLM-L6-v2] [--quantize]
+
+Writes model.onnx, tokenizer.json and, with --quantize, model-int8.onnx
+(dynamic int8 weight quantization). Needs torch and transformers for the
+export and onnx for both the export and the quantization step; all three are
+in requirements.txt, but the ONNX backend only needs onnxruntime at runtime.
+"""
+from db.onnx_embedder import ONNX_MODEL_DIR
+import argparse
+import os
+
+HF_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def export(out_dir, model_name=HF_MODEL, opset=17):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+
+    # tokenizer.json is all the ONNX backend needs at runtime
+    tokenizer.backend_tokenizer.save(os.path.join(out_dir, "tokenizer.json"))
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    model_path = os.path.join(out_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            model_path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            # TorchScript exporter: no onnxscript dependency, stable dynamic axes
+            dynamo=False
+        )
+    return model_path
+
+
+def quantize(model_path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    out_path = os.path.join(os.path.dirname(model_path), "model-int8.onnx")
+    quantize_dynamic(model_path, out_path, weight_type=QuantType.QInt8)
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default=ONNX_MODEL_DIR)
+    parser.add_argument("--model", default=HF_MODEL)
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--quantize", action="store_true", help="also write model-int8.onnx")
+    args = parser.parse_args()
+
+    model_path = export(args.out, args.model, args.opset)
+    print(f"Wrote {model_path}")
+    if args.quantize:
+        print(f"Wrote {quantize(model_path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,38 @@
-from pymongo import MongoClient
 from dotenv import load_dotenv
 import os
 from datetime import datetime
 from bson import ObjectId
+from db.cache import TTLCache
+from db.client import get_db
 
 load_dotenv()
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["chat_db"]
-personas = db["personas"]
 
-def create_persona(user_id, name, description, system_prompt,chat_history):
+def _personas():
+    return get_db()["personas"]
+
+# Personas rarely change, so keep them (and prompts derived from them) in process.
+# Entries are dropped on update/delete; the TTL bounds staleness across workers.
+PERSONA_CACHE_SIZE = int(os.getenv("PERSONA_CACHE_SIZE", "1024"))
+PERSONA_CACHE_TTL = float(os.getenv("PERSONA_CACHE_TTL", "300"))
+persona_cache = TTLCache(maxsize=PERSONA_CACHE_SIZE, ttl=PERSONA_CACHE_TTL)
+# Bumped by every invalidation; a load that overlapped one may have read the old persona
+_invalidations = 0
+
+async def create_persona(user_id, name, description, system_prompt,chat_history):
     doc = {
         "user_id": user_id,
         "name": name,
         "description": description,
         "system_prompt": system_prompt,
         "chat_history":chat_history,
+        "version": 1,
         "created_at": datetime.utcnow()
     }
-    result = personas.insert_one(doc)
+    result = await _personas().insert_one(doc)
     return str(result.inserted_id)
 
-def list_personas(user_id):
-     results = personas.find({"user_id": user_id})
+async def list_personas(user_id):
+     results = await _personas().find({"user_id": user_id}).to_list()
 
      return [
         {
@@ -36,28 +46,72 @@ def list_personas(user_id):
         for p in results
     ]
 
-def get_persona_from_db(persona_id):
+async def _load_persona(persona_id):
     # Convert string to ObjectId for querying
-    result = personas.find_one({"_id": ObjectId(persona_id)})
+    result = await _personas().find_one({"_id": ObjectId(persona_id)})
     if result:
         # Convert _id to string before returning
         result["_id"] = str(result["_id"])
     
     return result
 
-def get_persona_prompt(persona_id, user_id):
-    result = personas.find_one({"_id": ObjectId(persona_id), "user_id": user_id})
+async def _cached_entry(persona_id):
+    entry = persona_cache.get(persona_id)
+    if entry is None:
+        invalidations = _invalidations
+        persona = await _load_persona(persona_id)
+        if not persona:
+            return None
+        entry = {"persona": persona, "derived": {}}
+        current = persona_cache.peek(persona_id)
+        if current is not None and current["persona"].get("version", 0) >= persona.get("version", 0):
+            # A concurrent load already cached this version or a newer one
+            return current
+        if invalidations == _invalidations:
+            persona_cache.set(persona_id, entry)
+    return entry
+
+async def get_persona_from_db(persona_id):
+    """The persona document (a copy; the cached one is shared), or None"""
+    entry = await _cached_entry(persona_id)
+    return dict(entry["persona"]) if entry else None
+
+async def get_persona_derived(persona_id, name, build):
+    """Return build(persona), computed once per cached persona version.
+
+    Used for the rendered persona prompt and the compressed previous chat.
+    Returns None if the persona does not exist.
+    """
+    entry = await _cached_entry(persona_id)
+    if entry is None:
+        return None
+    derived = entry["derived"]
+    if name not in derived:
+        derived[name] = build(dict(entry["persona"]))
+    return derived[name]
+
+def invalidate_persona(persona_id):
+    global _invalidations
+    _invalidations += 1
+    persona_cache.pop(persona_id)
+
+def persona_cache_stats():
+    return persona_cache.stats()
+
+async def get_persona_prompt(persona_id, user_id):
+    result = await _personas().find_one({"_id": ObjectId(persona_id), "user_id": user_id})
     if result:
         return result.get("system_prompt")
     return None
 
 # NEW FUNCTIONS FOR DELETE AND EDIT
-def delete_persona(persona_id, user_id):
+async def delete_persona(persona_id, user_id):
     """Delete a persona if it belongs to the user"""
-    result = personas.delete_one({"_id": ObjectId(persona_id), "user_id": user_id})
+    result = await _personas().delete_one({"_id": ObjectId(persona_id), "user_id": user_id})
+    invalidate_persona(persona_id)
     return result.deleted_count > 0
 
-def update_persona(persona_id, user_id, name=None, description=None, traits=None, interests=None, writing_style=None,chat_history=None):
+async def update_persona(persona_id, user_id, name=None, description=None, traits=None, interests=None, writing_style=None,chat_history=None):
     """Update persona fields"""
     update_fields = {}
     
@@ -68,8 +122,8 @@ def update_persona(persona_id, user_id, name=None, description=None, traits=None
     
     # Build system prompt if any of the traits are provided
     if traits is not None or interests is not None or writing_style is not None or chat_history is not None:
-        # Get current persona to preserve existing values
-        current_persona = get_persona_from_db(persona_id)
+        # Get current persona to preserve existing values (bypass the cache)
+        current_persona = await _load_persona(persona_id)
         if not current_persona or current_persona.get("user_id") != user_id:
             return False
             
@@ -99,8 +153,9 @@ def update_persona(persona_id, user_id, name=None, description=None, traits=None
     if not update_fields:
         return False
         
-    result = personas.update_one(
+    result = await _personas().update_one(
         {"_id": ObjectId(persona_id), "user_id": user_id},
-        {"$set": update_fields}
+        {"$set": update_fields, "$inc": {"version": 1}}
     )
+    invalidate_persona(persona_id)
     return result.modified_count > 0
\ No newline at end of file
@@ -1,35 +1,132 @@
-from pymongo import MongoClient
 from dotenv import load_dotenv
-import os 
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from db.client import get_db
+import logging
 
 load_dotenv()
 
-mongo_client = MongoClient(os.getenv("MONGO_URI"))
-db = mongo_client["chat_db"]
-recommendations = db["recommendations"]
+logger = logging.getLogger(__name__)
+
+# One document per conversation:
+#   recommendations   append-only list, one entry per analysed user/assistant pair
+#   watermark         seq of the first message not analysed yet
+#   history_summary   rolling summary of the turns before summarized_until
+#   summarized_until  seq up to which turns are folded into history_summary
+# Documents written before this layout carry chathistory_till_now instead of
+# the last three fields; it is dropped on their next update.
+
+
+def _recommendations():
+    return get_db()["recommendations"]
+
+
+def _leases():
+    return get_db()["recommendation_leases"]
+
+
+def _filter(session_id, persona_id):
+    return {"session_id": session_id, "persona_id": persona_id}
+
+
+def _lease_id(session_id, persona_id):
+    return f"{session_id}:{persona_id}"
+
+
+async def ensure_recommendation_indexes():
+    try:
+        # Unique, so two refreshes racing to create the first document can't both win
+        await _recommendations().create_index([("session_id", 1), ("persona_id", 1)], unique=True)
+    except OperationFailure as e:
+        logger.warning("Unique recommendations index not created, falling back to a plain one: %s", e)
+        await _recommendations().create_index([("session_id", 1), ("persona_id", 1)])
+    # Leases left behind by a crashed worker are cleaned up by Mongo
+    await _leases().create_index("expires_at", expireAfterSeconds=0)
 
 
 async def fetch_recommendations_from_db(session_id,persona_id):
-    recoms = recommendations.find_one({
-        "session_id": session_id,
-        "persona_id": persona_id
-    })
+    recoms = await _recommendations().find_one(_filter(session_id, persona_id))
     return recoms
 
 
-def update_recommendations(session_id,persona_id,existing_recs,chathistory_till_now):
-   
-    recommendations.update_one(
-        {
-            "session_id": session_id,
-            "persona_id": persona_id
-        },
-        {
-            
-            "$set": {
-                "recommendations": existing_recs,
-                "chathistory_till_now": chathistory_till_now
-            }
+def recommendation_state(doc):
+    """Processing state of a recommendations document (None for a new conversation).
+
+    summarized_until is None when no rolling summary has been started yet.
+    """
+    if doc is None:
+        return {"recommendations": [], "watermark": 0, "stored_watermark": None,
+                "summary": "", "summarized_until": None}
+
+    recs = doc.get("recommendations", [])
+    watermark = doc.get("watermark")
+    if watermark is None:
+        # Legacy document: resume right after the last analysed pair
+        watermark = recs[-1]["message_index"] + 1 if recs else 0
+    return {
+        "recommendations": recs,
+        "watermark": watermark,
+        "stored_watermark": doc.get("watermark"),
+        "summary": doc.get("history_summary", ""),
+        "summarized_until": doc.get("summarized_until")
+    }
+
+
+async def append_recommendations(session_id, persona_id, new_recs, expected_watermark, watermark,
+                                 summary, summarized_until):
+    """Append new_recs and advance the watermark and rolling summary.
+
+    Applies only while the stored watermark still equals expected_watermark
+    (None: no watermark stored yet), so concurrent refreshes over the same
+    turns append once. Returns False if another refresh got there first.
+    """
+    query = _filter(session_id, persona_id)
+    query["watermark"] = {"$exists": False} if expected_watermark is None else expected_watermark
+
+    update = {
+        "$set": {
+            "watermark": watermark,
+            "history_summary": summary,
+            "summarized_until": summarized_until
         },
-        upsert=True
+        "$unset": {"chathistory_till_now": ""}
+    }
+    if new_recs:
+        update["$push"] = {"recommendations": {"$each": new_recs}}
+
+    try:
+        result = await _recommendations().update_one(query, update, upsert=expected_watermark is None)
+    except DuplicateKeyError:
+        return False
+    return result.matched_count > 0 or result.upserted_id is not None
+
+
+# Leases: while a worker analyses a conversation it holds a document in
+# recommendation_leases, so other workers wait for its results instead of
+# sending the same turns to the LLM.
+
+async def acquire_recommendation_lease(session_id, persona_id, owner, seconds):
+    """Take the conversation's lease for `seconds`. Returns False if another owner holds it."""
+    now = datetime.now(timezone.utc)
+    try:
+        # Matches only an expired lease; a live one makes the upsert collide on _id
+        await _leases().update_one(
+            {"_id": _lease_id(session_id, persona_id), "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def release_recommendation_lease(session_id, persona_id, owner):
+    await _leases().delete_one({"_id": _lease_id(session_id, persona_id), "owner": owner})
+
+
+async def recommendation_lease_held(session_id, persona_id):
+    lease = await _leases().find_one(
+        {"_id": _lease_id(session_id, persona_id), "expires_at": {"$gt": datetime.now(timezone.utc)}},
+        {"_id": 1}
     )
+    return lease is not None
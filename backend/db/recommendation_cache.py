@@ -0,0 +1,150 @@
+"""Content-addressed cache for coaching results.
+
+A recommendation depends only on the user message, the chat history window
+it is judged against, the persona and the user profile. Persona and profile
+carry a version that is bumped on every update, so a hash of
+(message, history, persona version, profile version) identifies a result
+exactly. Retries, regenerations and parallel tabs therefore reuse it
+instead of calling the LLM again.
+
+Results live in a small in-process LRU in front of the
+recommendation_cache Mongo collection, which a TTL index expires.
+"""
+from dotenv import load_dotenv
+from datetime import datetime, timedelta, timezone
+from db.cache import TTLCache, single_flight
+from db.client import get_db
+import hashlib
+import json
+import logging
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "2048"))
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", str(7 * 24 * 3600)))
+# Off: only the in-process LRU is used
+RECOMMENDATION_CACHE_PERSIST = os.getenv("RECOMMENDATION_CACHE_PERSIST", "true").lower() in ("1", "true", "yes")
+# Bump when the prompt changes so old answers are not served for it
+PROMPT_VERSION = 1
+
+recommendation_cache = TTLCache(maxsize=RECOMMENDATION_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL)
+
+# key -> task computing it in this process
+_inflight = {}
+_stats = {
+    "memory_hits": 0,
+    "store_hits": 0,
+    "coalesced": 0,
+    "misses": 0,
+    "store_errors": 0
+}
+
+
+def _store():
+    return get_db()["recommendation_cache"]
+
+
+async def ensure_recommendation_cache_indexes():
+    # Expiry is stored per document, so changing the TTL never conflicts with the index
+    await _store().create_index("expires_at", expireAfterSeconds=0)
+
+
+def recommendation_key(user_text, chat_history, persona_details, user_details):
+    persona_details = persona_details or {}
+    user_details = user_details or {}
+    material = json.dumps([
+        PROMPT_VERSION,
+        user_text,
+        chat_history,
+        persona_details.get("_id"),
+        persona_details.get("version", 0),
+        user_details.get("user_id"),
+        user_details.get("version", 0)
+    ], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+async def get_cached_recommendation(key):
+    result = recommendation_cache.get(key)
+    if result is not None:
+        _stats["memory_hits"] += 1
+        return result
+    if not RECOMMENDATION_CACHE_PERSIST:
+        return None
+
+    try:
+        doc = await _store().find_one(
+            {"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+            {"result": 1}
+        )
+    except Exception as e:
+        # A cache outage should cost an LLM call, not the request
+        _stats["store_errors"] += 1
+        logger.warning("Recommendation cache read failed: %s", e)
+        return None
+    if doc is None:
+        return None
+    _stats["store_hits"] += 1
+    recommendation_cache.set(key, doc["result"])
+    return doc["result"]
+
+
+async def put_cached_recommendation(key, result):
+    recommendation_cache.set(key, result)
+    if not RECOMMENDATION_CACHE_PERSIST:
+        return
+    now = datetime.now(timezone.utc)
+    try:
+        await _store().update_one(
+            {"_id": key},
+            {"$set": {
+                "result": result,
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=RECOMMENDATION_CACHE_TTL)
+            }},
+            upsert=True
+        )
+    except Exception as e:
+        _stats["store_errors"] += 1
+        logger.warning("Recommendation cache write failed: %s", e)
+
+
+async def cached_recommendation(key, compute):
+    """Return the cached result for key, or await compute() once and cache it.
+
+    Concurrent callers with the same key share one compute() call, which
+    keeps running for the others if the caller that started it is cancelled.
+    """
+    result = await get_cached_recommendation(key)
+    if result is not None:
+        return result
+
+    if key in _inflight:
+        _stats["coalesced"] += 1
+    else:
+        # Another caller may have finished computing it while we were reading the store
+        result = recommendation_cache.get(key)
+        if result is not None:
+            _stats["memory_hits"] += 1
+            return result
+        _stats["misses"] += 1
+
+    async def compute_and_store():
+        result = await compute()
+        await put_cached_recommendation(key, result)
+        return result
+
+    return await single_flight(_inflight, key, compute_and_store)
+
+
+def recommendation_cache_stats():
+    hits = _stats["memory_hits"] + _stats["store_hits"] + _stats["coalesced"]
+    lookups = hits + _stats["misses"]
+    return {
+        **_stats,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "memory": recommendation_cache.stats()
+    }
@@ -1,27 +1,29 @@
 # userprofile.py
 from fastapi import APIRouter
-from pymongo import MongoClient
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
-import os
+from db.client import get_db
 
 load_dotenv()
 
 router = APIRouter()
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["chat_db"]
-profile_collection = db["user_profiles"]
 
 
-def get_user_profile(user_id: str):
-    profile = profile_collection.find_one({"user_id": user_id}, {"_id": 0})
+def _profiles():
+    return get_db()["user_profiles"]
+
+
+async def get_user_profile(user_id: str):
+    profile = await _profiles().find_one({"user_id": user_id}, {"_id": 0})
     return profile or {}
 
-def update_user_profile(payload: dict):
+async def update_user_profile(payload: dict):
     user_id = payload["user_id"]
-    profile_collection.update_one(
+    # The version keys cached recommendations, so edits invalidate them
+    payload = {k: v for k, v in payload.items() if k != "version"}
+    await _profiles().update_one(
         {"user_id": user_id},
-        {"$set": payload},
+        {"$set": payload, "$inc": {"version": 1}},
         upsert=True
     )
     return {"status": "success", "message": "Profile updated"}
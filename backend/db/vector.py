@@ -1,52 +1,99 @@
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
-
-# Persistent storage
-chroma_client = chromadb.PersistentClient(
-    path="./chroma_storage",
-    settings=Settings(allow_reset=True)
-)
-
-collection = chroma_client.get_or_create_collection("chat_memory")
-
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
-
-def add_to_vector_db(session_id, persona_id, role, text):
-    embedding = embedding_model.encode(text).tolist()
-    doc_id = f"{session_id}_{persona_id}_{role}_{len(text)}"
-    collection.add(
-        documents=[text],
-        embeddings=[embedding],
-        ids=[doc_id],
-        metadatas=[{
-            "session_persona": f"{session_id}::{persona_id}",
-            "role": role
-        }]
-    )
-
-def query_similar(session_id, persona_id, query_text, top_k=10):
-    query_emb = embedding_model.encode(query_text).tolist()
-    return collection.query(
-        query_embeddings=[query_emb],
-        n_results=top_k,
-        where={"session_persona": f"{session_id}::{persona_id}"}
-    )["documents"][0]
+from db.embeddings import embed_sync, encode
+from db.hot_index import HOT_INDEX_ENABLED, hot_index
+from db.vector_store import get_store, session_persona
+from dotenv import load_dotenv
+import hashlib
+import logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def _use_hot_index():
+    if HOT_INDEX_ENABLED == "auto":
+        # A store other processes write to would leave the in-process copy stale
+        return get_store().process_local
+    return HOT_INDEX_ENABLED in ("1", "true", "yes")
+
+def memory_id(session_id, persona_id, role, text, seq=None):
+    """Stable id for a memory: the message seq when known, else a content hash"""
+    if seq is not None:
+        return f"{session_id}_{persona_id}_{seq}"
+    digest = hashlib.sha256(f"{role}\x00{text}".encode("utf-8")).hexdigest()[:32]
+    return f"{session_id}_{persona_id}_{digest}"
+
+def upsert_vectors(items):
+    """Write a batch of memories in one call.
+
+    Each item is a dict with session_id, persona_id, role, text and optionally
+    embedding and seq. Missing embeddings are computed in one batch.
+    """
+    if not items:
+        return
+    missing = [i for i, item in enumerate(items) if item.get("embedding") is None]
+    if missing:
+        for i, vec in zip(missing, encode([items[i]["text"] for i in missing])):
+            items[i] = {**items[i], "embedding": vec}
+
+    batches = {}
+    for item in items:
+        metadata = {"role": item["role"]}
+        if item.get("seq") is not None:
+            metadata["seq"] = item["seq"]
+        batches.setdefault((item["session_id"], item["persona_id"]), []).append({
+            "id": memory_id(item["session_id"], item["persona_id"], item["role"], item["text"], item.get("seq")),
+            "embedding": item["embedding"],
+            "document": item["text"],
+            "metadata": metadata
+        })
+    get_store().upsert_many(batches)
+
+    # Only after the store write, so a hot-tier load never misses it
+    for conversation, records in batches.items():
+        hot_index.upsert(
+            session_persona(*conversation),
+            [r["id"] for r in records], [r["embedding"] for r in records], [r["document"] for r in records]
+        )
+
+def add_to_vector_db(session_id, persona_id, role, text, embedding=None, seq=None):
+    """Store a message; pass `embedding` if it was already computed"""
+    upsert_vectors([{
+        "session_id": session_id,
+        "persona_id": persona_id,
+        "role": role,
+        "text": text,
+        "embedding": embedding,
+        "seq": seq
+    }])
+
+def _load_conversation(session_id, persona_id):
+    """All of a conversation's memories for the hot tier, or None if there are too many"""
+    store = get_store()
+    if store.count((session_id, persona_id)) > hot_index.max_rows:
+        return None
+    return store.get_all((session_id, persona_id))
+
+def query_similar(session_id, persona_id, query_text, top_k=10, query_embedding=None):
+    if query_embedding is None:
+        query_embedding = embed_sync(query_text)
+    if _use_hot_index():
+        hits = hot_index.query(
+            session_persona(session_id, persona_id), query_embedding, top_k,
+            lambda key: _load_conversation(session_id, persona_id)
+        )
+        if hits is not None:
+            return hits
+    return get_store().query((session_id, persona_id), query_embedding, top_k)
 
 
 
 def delete_vector_memories(session_id, persona_id):
     """Delete all vector memories for a specific session and persona"""
+    hot_index.drop(session_persona(session_id, persona_id))
     try:
-        # Get all documents matching the session_persona
-        results = collection.get(
-            where={"session_persona": f"{session_id}::{persona_id}"}
-        )
-        
-        if results and results.get("ids"):
-            collection.delete(ids=results["ids"])
-            return True
-        return True  # Return True even if no documents found (considered successful)
+        get_store().delete_conversation((session_id, persona_id))
+        return True  # Also when nothing was stored (considered successful)
     except Exception as e:
-        print(f"Error deleting vector memories: {e}")
-        return False
\ No newline at end of file
+        logger.exception("Error deleting vector memories: %s", e)
+        return False
@@ -0,0 +1,145 @@
+"""Write-behind ingestion of chat memories into Chroma.
+
+enqueue_memory() returns as soon as the memory is queued; a background task collects queued
+memories and writes them with one upsert per batch, flushing when
+VECTOR_INGEST_BATCH_SIZE items are waiting or VECTOR_INGEST_FLUSH_MS has
+passed since the first one arrived. The queue is drained on shutdown.
+"""
+from db.vector import upsert_vectors
+from dotenv import load_dotenv
+from services.telemetry import histogram
+import asyncio
+import logging
+import os
+import time
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INGEST_QUEUE_SIZE = int(os.getenv("VECTOR_INGEST_QUEUE_SIZE", "10000"))
+VECTOR_INGEST_BATCH_SIZE = int(os.getenv("VECTOR_INGEST_BATCH_SIZE", "64"))
+VECTOR_INGEST_FLUSH_MS = float(os.getenv("VECTOR_INGEST_FLUSH_MS", "200"))
+
+FLUSH_SECONDS = histogram("rizzy_vector_ingest_flush_seconds", "Time each write-behind batch took to reach Chroma")
+
+_queue = None
+_worker = None
+_stop = object()
+
+_stats = {
+    "enqueued": 0,
+    "written": 0,
+    "failed": 0,
+    "sync_writes": 0,
+    "flushes": 0,
+    "last_flush_seconds": 0.0,
+    "max_flush_seconds": 0.0,
+    "total_flush_seconds": 0.0
+}
+
+
+async def enqueue_memory(session_id, persona_id, role, text, embedding=None, seq=None):
+    """Queue a memory for writing. Falls back to a direct write (in a thread)
+    if the writer is not running or the queue is full, so memories are never
+    dropped."""
+    item = {
+        "session_id": session_id,
+        "persona_id": persona_id,
+        "role": role,
+        "text": text,
+        "embedding": embedding,
+        "seq": seq
+    }
+    if _queue is not None:
+        try:
+            _queue.put_nowait(item)
+            _stats["enqueued"] += 1
+            return
+        except asyncio.QueueFull:
+            pass
+    _stats["sync_writes"] += 1
+    # Over chroma-http this is a network round trip; keep it off the loop
+    await asyncio.to_thread(upsert_vectors, [item])
+
+
+async def _flush(batch):
+    started = time.perf_counter()
+    try:
+        # Chroma writes hit SQLite and the HNSW index, keep them off the loop
+        await asyncio.to_thread(upsert_vectors, batch)
+        _stats["written"] += len(batch)
+    except Exception as e:
+        _stats["failed"] += len(batch)
+        logger.exception("Error writing vector memories: %s", e)
+    elapsed = time.perf_counter() - started
+    FLUSH_SECONDS.observe(elapsed)
+    _stats["flushes"] += 1
+    _stats["last_flush_seconds"] = elapsed
+    _stats["total_flush_seconds"] += elapsed
+    _stats["max_flush_seconds"] = max(_stats["max_flush_seconds"], elapsed)
+
+
+async def _run(queue):
+    # Its own reference: stop_vector_ingest() clears _queue while this drains it
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await queue.get()
+        if item is _stop:
+            return
+        batch = [item]
+        deadline = loop.time() + VECTOR_INGEST_FLUSH_MS / 1000
+        stopping = False
+        while len(batch) < VECTOR_INGEST_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _stop:
+                stopping = True
+                break
+            batch.append(item)
+        await _flush(batch)
+        if stopping:
+            return
+
+
+def start_vector_ingest():
+    global _queue, _worker
+    if _worker is not None:
+        return
+    _queue = asyncio.Queue(maxsize=VECTOR_INGEST_QUEUE_SIZE)
+    _worker = asyncio.create_task(_run(_queue))
+
+
+async def stop_vector_ingest():
+    """Flush everything still queued, then stop the writer"""
+    global _queue, _worker
+    if _worker is None:
+        return
+    queue, worker = _queue, _worker
+    # New memories are written directly from here on
+    _queue = None
+    await queue.put(_stop)
+    await worker
+    _worker = None
+
+    leftover = []
+    while not queue.empty():
+        item = queue.get_nowait()
+        if item is not _stop:
+            leftover.append(item)
+    for start in range(0, len(leftover), VECTOR_INGEST_BATCH_SIZE):
+        await _flush(leftover[start:start + VECTOR_INGEST_BATCH_SIZE])
+
+
+def vector_ingest_stats():
+    flushes = _stats["flushes"]
+    return {
+        **_stats,
+        "queue_depth": _queue.qsize() if _queue is not None else 0,
+        "avg_flush_seconds": _stats["total_flush_seconds"] / flushes if flushes else 0.0
+    }
@@ -0,0 +1,309 @@
+"""Storage backends for conversation memories.
+
+A conversation is a (session_id, persona_id) pair and a record a dict with
+id, embedding, document and metadata. VECTOR_STORE picks the backend:
+  chroma        embedded Chroma in CHROMA_PATH (default, one process only)
+  chroma-http   a Chroma server at CHROMA_HOST:CHROMA_PORT, shared by every
+                worker and node
+  memory        plain in-process dicts, for tests and benchmarks
+
+Every backend must pass tests/test_vector_store.py.
+"""
+from dotenv import load_dotenv
+import hashlib
+import numpy as np
+import os
+import threading
+
+load_dotenv()
+
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")
+
+# "conversation": one collection per session/persona (default)
+# "shard": VECTOR_SHARDS hashed collections, filtered by session_persona
+# "global": the original single chat_memory collection
+VECTOR_PARTITION_MODE = os.getenv("VECTOR_PARTITION_MODE", "conversation")
+VECTOR_SHARDS = int(os.getenv("VECTOR_SHARDS", "16"))
+LEGACY_COLLECTION = "chat_memory"
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_storage")
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+CHROMA_SSL = os.getenv("CHROMA_SSL", "false").lower() in ("1", "true", "yes")
+
+
+def session_persona(session_id, persona_id):
+    return f"{session_id}::{persona_id}"
+
+
+class VectorStore:
+    """Interface every memory store implements"""
+
+    # True when only this process writes the store, so in-process copies
+    # (the hot index) can't go stale
+    process_local = True
+
+    def warm(self):
+        """Open connections ahead of the first request"""
+
+    def add(self, conversation, records):
+        """Insert records; ids that already exist keep their stored value"""
+        raise NotImplementedError
+
+    def upsert(self, conversation, records):
+        """Insert records, replacing any with the same id"""
+        raise NotImplementedError
+
+    def add_many(self, batches):
+        """add() for several conversations: {conversation: records}"""
+        for conversation, records in batches.items():
+            self.add(conversation, records)
+
+    def upsert_many(self, batches):
+        """upsert() for several conversations: {conversation: records}"""
+        for conversation, records in batches.items():
+            self.upsert(conversation, records)
+
+    def query(self, conversation, embedding, top_k):
+        """Documents of the top_k nearest records, nearest first"""
+        return self.query_many(conversation, [embedding], top_k)[0]
+
+    def query_many(self, conversation, embeddings, top_k):
+        raise NotImplementedError
+
+    def get_all(self, conversation):
+        """(ids, embeddings, documents) of every record in the conversation"""
+        raise NotImplementedError
+
+    def count(self, conversation):
+        raise NotImplementedError
+
+    def delete_conversation(self, conversation):
+        raise NotImplementedError
+
+
+class ChromaStore(VectorStore):
+    """Chroma, embedded (PersistentClient) or over HTTP (HttpClient)"""
+
+    def __init__(self, make_client, process_local=True, partition_mode=VECTOR_PARTITION_MODE,
+                 shards=VECTOR_SHARDS):
+        self._make_client = make_client
+        self.process_local = process_local
+        self.partition_mode = partition_mode
+        self.shards = shards
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._collections = {}
+
+    @property
+    def client(self):
+        """Opened on first use (or during warmup)"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._make_client()
+        return self._client
+
+    def warm(self):
+        self.client.heartbeat()
+
+    def collection_name(self, conversation):
+        """Name of the collection holding this conversation's memories"""
+        if self.partition_mode == "global":
+            return LEGACY_COLLECTION
+        digest = hashlib.sha256(session_persona(*conversation).encode("utf-8")).hexdigest()
+        if self.partition_mode == "shard":
+            return f"{LEGACY_COLLECTION}_{int(digest, 16) % self.shards:03d}"
+        return f"mem_{digest[:40]}"
+
+    def _is_shared(self):
+        return self.partition_mode != "conversation"
+
+    def get_collection(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self.client.get_or_create_collection(name)
+            self._collections[name] = collection
+        return collection
+
+    def _where(self, conversation):
+        # Only shared collections need a filter
+        return {"session_persona": session_persona(*conversation)} if self._is_shared() else None
+
+    def _write(self, batches, method):
+        # One call per collection, however many conversations share it
+        by_collection = {}
+        for conversation, records in batches.items():
+            group = by_collection.setdefault(self.collection_name(conversation), {
+                "ids": [], "embeddings": [], "documents": [], "metadatas": []
+            })
+            for record in records:
+                group["ids"].append(record["id"])
+                group["embeddings"].append(record["embedding"])
+                group["documents"].append(record["document"])
+                group["metadatas"].append({
+                    **(record.get("metadata") or {}), "session_persona": session_persona(*conversation)
+                })
+        for name, group in by_collection.items():
+            if group["ids"]:
+                getattr(self.get_collection(name), method)(**group)
+
+    def add(self, conversation, records):
+        self.add_many({conversation: records})
+
+    def upsert(self, conversation, records):
+        self.upsert_many({conversation: records})
+
+    def add_many(self, batches):
+        # Chroma's add() rejects or skips existing ids depending on the
+        # deployment, so drop them up front
+        fresh = {}
+        for conversation, records in batches.items():
+            ids = [r["id"] for r in records]
+            existing = set()
+            if ids:
+                existing = set(self.get_collection(self.collection_name(conversation)).get(ids=ids, include=[])["ids"])
+            fresh[conversation] = [r for r in records if r["id"] not in existing]
+        self._write(fresh, "add")
+
+    def upsert_many(self, batches):
+        self._write(batches, "upsert")
+
+    def query_many(self, conversation, embeddings, top_k):
+        collection = self.get_collection(self.collection_name(conversation))
+        n_results = top_k
+        if not self._is_shared():
+            # The collection only holds this conversation; Chroma wants n_results <= count
+            n_results = min(top_k, collection.count())
+            if n_results == 0:
+                return [[] for _ in embeddings]
+        return collection.query(
+            query_embeddings=list(embeddings),
+            n_results=n_results,
+            where=self._where(conversation),
+            include=["documents"]
+        )["documents"]
+
+    def get_all(self, conversation):
+        got = self.get_collection(self.collection_name(conversation)).get(
+            where=self._where(conversation),
+            include=["embeddings", "documents"]
+        )
+        return got["ids"], list(got["embeddings"]), got["documents"]
+
+    def count(self, conversation):
+        collection = self.get_collection(self.collection_name(conversation))
+        if not self._is_shared():
+            return collection.count()
+        return len(collection.get(where=self._where(conversation), include=[])["ids"])
+
+    def delete_conversation(self, conversation):
+        name = self.collection_name(conversation)
+        if not self._is_shared() and self.process_local:
+            # The whole collection belongs to this conversation: drop it.
+            # Over HTTP other workers may hold it open, so it is only emptied.
+            self._collections.pop(name, None)
+            try:
+                self.client.delete_collection(name)
+            except Exception:
+                pass  # Nothing stored yet
+            return
+        collection = self.get_collection(name)
+        ids = collection.get(where=self._where(conversation), include=[])["ids"]
+        if ids:
+            collection.delete(ids=ids)
+
+
+class MemoryStore(VectorStore):
+    """Exact search over in-process dicts; nothing is persisted"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def add(self, conversation, records):
+        with self._lock:
+            stored = self._data.setdefault(conversation, {})
+            for record in records:
+                if record["id"] not in stored:
+                    stored[record["id"]] = self._entry(record)
+
+    def upsert(self, conversation, records):
+        with self._lock:
+            stored = self._data.setdefault(conversation, {})
+            for record in records:
+                stored[record["id"]] = self._entry(record)
+
+    @staticmethod
+    def _entry(record):
+        return (np.asarray(record["embedding"], dtype=np.float32), record["document"], dict(record.get("metadata") or {}))
+
+    def query_many(self, conversation, embeddings, top_k):
+        with self._lock:
+            entries = list(self._data.get(conversation, {}).values())
+        if not entries:
+            return [[] for _ in embeddings]
+        matrix = np.stack([e[0] for e in entries])
+        out = []
+        for embedding in embeddings:
+            distances = ((matrix - np.asarray(embedding, dtype=np.float32)) ** 2).sum(axis=1)
+            order = np.argsort(distances, kind="stable")[:top_k]
+            out.append([entries[i][1] for i in order])
+        return out
+
+    def get_all(self, conversation):
+        with self._lock:
+            stored = dict(self._data.get(conversation, {}))
+        return list(stored), [e[0] for e in stored.values()], [e[1] for e in stored.values()]
+
+    def count(self, conversation):
+        with self._lock:
+            return len(self._data.get(conversation, {}))
+
+    def delete_conversation(self, conversation):
+        with self._lock:
+            self._data.pop(conversation, None)
+
+
+def _persistent_client(path=CHROMA_PATH):
+    import chromadb
+    from chromadb.config import Settings
+    return chromadb.PersistentClient(path=path, settings=Settings(allow_reset=True))
+
+
+def _http_client(host=CHROMA_HOST, port=CHROMA_PORT, ssl=CHROMA_SSL):
+    import chromadb
+    return chromadb.HttpClient(host=host, port=port, ssl=ssl)
+
+
+def make_store(name=VECTOR_STORE, **options) -> VectorStore:
+    if name == "chroma":
+        path = options.pop("path", CHROMA_PATH)
+        return ChromaStore(lambda: _persistent_client(path), process_local=True, **options)
+    if name == "chroma-http":
+        host = options.pop("host", CHROMA_HOST)
+        port = options.pop("port", CHROMA_PORT)
+        ssl = options.pop("ssl", CHROMA_SSL)
+        return ChromaStore(lambda: _http_client(host, port, ssl), process_local=False, **options)
+    if name == "memory":
+        return MemoryStore()
+    raise ValueError(f"Unknown VECTOR_STORE: {name}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> VectorStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = make_store()
+    return _store
+
+
+def set_store(store: VectorStore):
+    """Swap the memory store (e.g. MemoryStore in tests)"""
+    global _store
+    _store = store
@@ -1,16 +1,34 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from services.chat import chat
-from services.recommendation import get_message_recommendation
-from db.mongo import get_messages, delete_chat_history
-from db.persona import create_persona, list_personas, get_persona_from_db, delete_persona, update_persona
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from services.chat import PersonaNotFound, chat, chat_stream
+from services.recommendation import refresh_recommendations
+from services.precompute import start_precompute_worker, stop_precompute_worker
+from services.summarizer import start_summary_worker, stop_summary_worker
+from services.scheduler import COACHING, INTERACTIVE, LLMOverloaded, charge_user
+from services.warmup import readiness, start_warmup, stop_warmup
+from services.telemetry import RequestContextMiddleware, configure_logging, counter_callback, gauge_callback, render_metrics
+from db.client import init_mongo, close_mongo
+from db.embeddings import embedding_cache_stats
+from db.hot_index import hot_index_stats
+from db.mongo import get_conversation_version, get_messages, delete_chat_history
+from db.persona import create_persona, list_personas, get_persona_from_db, delete_persona, update_persona, persona_cache_stats
+from db.recommendation_cache import recommendation_cache_stats
 from db.vector import delete_vector_memories
+from db.vector_ingest import start_vector_ingest, stop_vector_ingest, vector_ingest_stats
 from db.user_profile import get_user_profile,update_user_profile
-from db.recommendation import fetch_recommendations_from_db, update_recommendations
 from pydantic import BaseModel
 from typing import Optional
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import logging
+import math
 import uuid
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 
 class PersonaUpdateRequest(BaseModel):
     userId: str
@@ -49,20 +67,98 @@ class SuggestionRequest(BaseModel):
     session_id: str
     persona_id: str
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_mongo()
+    start_vector_ingest()
+    start_precompute_worker()
+    start_summary_worker()
+    start_warmup()
+    yield
+    await stop_warmup()
+    await stop_summary_worker()
+    await stop_precompute_worker()
+    await stop_vector_ingest()
+    await close_mongo()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000","http://localhost:9002"],
     allow_credentials = True,
     allow_methods =["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-Request-ID", "ETag", "X-Has-More"]
+)
+# Outermost, so its timings include CORS handling
+app.add_middleware(RequestContextMiddleware)
+
+
+@app.exception_handler(LLMOverloaded)
+async def llm_overloaded(request: Request, exc: LLMOverloaded):
+    """Shed LLM calls fail fast with 429 (user rate limit) or 503 (overload)"""
+    return JSONResponse(
+        {"error": str(exc)},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    )
+
+
+def _cache_stat(stat):
+    def read():
+        return {
+            "embedding": embedding_cache_stats()[stat],
+            "persona": persona_cache_stats()[stat],
+            "recommendation": recommendation_cache_stats()["memory"][stat]
+        }
+    return read
+
+gauge_callback("rizzy_cache_entries", "Entries held by each in-process cache", _cache_stat("size"), "cache")
+counter_callback("rizzy_cache_hits_total", "In-process cache hits", _cache_stat("hits"), "cache")
+counter_callback("rizzy_cache_misses_total", "In-process cache misses", _cache_stat("misses"), "cache")
+counter_callback(
+    "rizzy_recommendation_cache_lookups_total", "Recommendation cache lookups by outcome",
+    lambda: {k: v for k, v in recommendation_cache_stats().items() if k in ("memory_hits", "store_hits", "coalesced", "misses", "store_errors")},
+    "result"
+)
+gauge_callback("rizzy_hot_index_bytes", "Memory held by the hot memory index", lambda: hot_index_stats()["bytes"])
+gauge_callback("rizzy_hot_index_conversations", "Conversations held by the hot memory index", lambda: hot_index_stats()["conversations"])
+counter_callback(
+    "rizzy_hot_index_lookups_total", "Memory lookups by how the hot index served them",
+    lambda: {k: v for k, v in hot_index_stats().items() if k in ("hits", "loads", "fallbacks", "evictions")},
+    "result"
+)
+gauge_callback("rizzy_vector_ingest_queue_depth", "Memories waiting to be written to Chroma", lambda: vector_ingest_stats()["queue_depth"])
+gauge_callback("rizzy_vector_ingest_last_flush_seconds", "Duration of the latest write-behind flush", lambda: vector_ingest_stats()["last_flush_seconds"])
+gauge_callback("rizzy_vector_ingest_max_flush_seconds", "Slowest write-behind flush since startup", lambda: vector_ingest_stats()["max_flush_seconds"])
+counter_callback(
+    "rizzy_vector_ingest_memories_total", "Memories handled by the write-behind queue",
+    lambda: {k: v for k, v in vector_ingest_stats().items() if k in ("enqueued", "written", "failed", "sync_writes")},
+    "state"
 )
 
 
+@app.get("/healthz")
+async def healthz():
+    """The process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Models are loaded (unless WARMUP_ON_STARTUP is off) and Mongo is reachable"""
+    status = await readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this worker"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/create_persona")
-def create_persona_api(req: PersonaCreateRequest):
-    persona_id = create_persona(
+async def create_persona_api(req: PersonaCreateRequest):
+    persona_id = await create_persona(
         req.userId,
         req.name,
         req.description,
@@ -72,30 +168,106 @@ def create_persona_api(req: PersonaCreateRequest):
     return {"persona_id": persona_id}
 
 @app.get("/list_personas")
-def list_personas_api(user_id: str):
-    return list_personas(user_id)
+async def list_personas_api(user_id: str):
+    return await list_personas(user_id)
 
 @app.post("/send_message")
 async def send_message(req: MessageRequest):
     session_id = req.session_id or str(uuid.uuid4())
-    reply = chat(session_id, req.persona_id, req.message)
+    charge_user(session_id, INTERACTIVE)
+    reply = await chat(session_id, req.persona_id, req.message)
     return {"session_id": session_id, "response": reply}
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/send_message_stream")
+async def send_message_stream(req: MessageRequest):
+    """Server-Sent Events version of /send_message.
+
+    Emits a `session` event, one `token` event per chunk and a final `done`
+    event carrying the full reply (or an `error` event if generation fails).
+    """
+    session_id = req.session_id or str(uuid.uuid4())
+    # Charged before the stream starts, so a rate-limited call is a real 429
+    charge_user(session_id, INTERACTIVE)
+
+    async def events():
+        yield _sse("session", {"session_id": session_id})
+        parts = []
+        try:
+            async for chunk in chat_stream(session_id, req.persona_id, req.message):
+                parts.append(chunk)
+                yield _sse("token", {"token": chunk})
+        except LLMOverloaded as e:
+            # Headers are already sent; the client gets the status in the event instead
+            yield _sse("error", {"error": str(e), "status": e.status_code, "retry_after": e.retry_after})
+            return
+        except PersonaNotFound as e:
+            yield _sse("error", {"error": str(e), "status": 404})
+            return
+        except Exception as e:
+            yield _sse("error", {"error": str(e)})
+            return
+        yield _sse("done", {"session_id": session_id, "response": "".join(parts).strip()})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 from fastapi import Query
 
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+def _history_complete(messages, message_count, before, since):
+    # save_messages reserves seqs before the messages land in their buckets;
+    # a response read in between must not carry the new version
+    last = (min(message_count, before) if before is not None else message_count) - 1
+    if last < 0 or (since is not None and since > last):
+        return True
+    return bool(messages) and messages[-1]["seq"] >= last
+
 @app.get("/get_history")
 async def get_history(
+    request: Request,
     session_id: str = Query(...),
-    persona_id: str = Query(...)
+    persona_id: str = Query(...),
+    before: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    since: Optional[int] = Query(None, ge=0)
 ):
-    messages = get_messages(session_id, persona_id)
-    
-    return messages
+    """Messages in seq order.
+
+    Pass `limit` (and `before=<oldest seq seen>`) to page backwards, or
+    `since=<newest seq seen + 1>` to poll for new messages only. With both
+    `since` and `limit` the oldest `limit` new messages come back, and
+    X-Has-More: true says to poll again from the last one. The ETag is the
+    conversation version; sending it back in If-None-Match gets a 304
+    without the messages being read.
+    """
+    head = await get_conversation_version(session_id, persona_id)
+    etag = f'"{head["version"]}"' if head else '"empty"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    messages = await get_messages(session_id, persona_id, before=before, limit=limit, since=since)
+    if head and not _history_complete(messages, head["message_count"], before, since):
+        del headers["ETag"]
+        if since is not None and limit and len(messages) == limit:
+            headers["X-Has-More"] = "true"
+    return ORJSONResponse(messages, headers=headers)
 
 @app.get("/get_persona")
 async def get_persona(persona_id: str = Query(...)):
-    persona = get_persona_from_db(persona_id)  # Implement this function to get persona data
+    persona = await get_persona_from_db(persona_id)  # Implement this function to get persona data
     if not persona:
         return {"error": "Persona not found"}, 404
     return persona
@@ -104,7 +276,7 @@ async def get_persona(persona_id: str = Query(...)):
 async def delete_chat(req: DeleteChatRequest):
     """Delete all chat history for a session and persona"""
     # Delete from MongoDB
-    mongo_deleted = delete_chat_history(req.session_id, req.persona_id)
+    mongo_deleted = await delete_chat_history(req.session_id, req.persona_id)
     
     # Delete from vector database
     #vector_deleted = delete_vector_memories(req.session_id, req.persona_id)
@@ -117,8 +289,9 @@ async def delete_chat(req: DeleteChatRequest):
 @app.delete("/delete_persona")
 async def delete_persona_api(req: DeletePersonaRequest):
     """Delete a persona"""
-    success = delete_persona(req.persona_id, req.userId)
-    vector_deleted = delete_vector_memories(req.userId, req.persona_id)
+    success = await delete_persona(req.persona_id, req.userId)
+    # Chroma deletes are blocking; keep them off the loop
+    vector_deleted = await asyncio.to_thread(delete_vector_memories, req.userId, req.persona_id)
     
     if success:
         return {"success": True, "message": "Persona deleted successfully"}
@@ -128,7 +301,7 @@ async def delete_persona_api(req: DeletePersonaRequest):
 @app.put("/update_persona/{persona_id}")
 async def update_persona_api(persona_id: str, req: PersonaUpdateRequest):
     """Update persona details"""
-    success = update_persona(
+    success = await update_persona(
         persona_id=persona_id,
         user_id=req.userId,
         name=req.name,
@@ -147,13 +320,13 @@ async def update_persona_api(persona_id: str, req: PersonaUpdateRequest):
 
 @app.get("/get_profile")
 async def get_profile(user_id: str):
-    profile = get_user_profile(user_id)
+    profile = await get_user_profile(user_id)
     return profile or {}
 
 @app.put("/update_profile")
 async def update_profile(payload: dict):
     
-    a = update_user_profile(payload)
+    a = await update_user_profile(payload)
     return {"status": "success", "message": "Profile updated"}
 
 
@@ -162,60 +335,18 @@ async def update_profile(payload: dict):
 
 @app.post("/suggest")
 async def send_suggestion(suggestionData: SuggestionRequest):
-   
-    chats =  await get_history(suggestionData.session_id,suggestionData.persona_id)
+    # One request, however many turn pairs the refresh analyses
+    charge_user(suggestionData.session_id, COACHING)
+    result = await refresh_recommendations(suggestionData.session_id, suggestionData.persona_id)
 
-    if not chats:
-        print("No chats found")
+    if result is None:
+        logger.info("No chats found for suggestion")
         return {"error": "No chat history found."}
 
-    messages = chats
-    rec_doc = await fetch_recommendations_from_db(suggestionData.session_id, suggestionData.persona_id)
-
-    existing_recs = rec_doc["recommendations"] if rec_doc else []
-    last_index = existing_recs[-1]["message_index"] if existing_recs else -1
-    chat_history_so_far = rec_doc["chathistory_till_now"] if rec_doc else ""
-
-    new_chat_history = chat_history_so_far
-    updated_recommendations = []
-
-    user_details = get_user_profile(suggestionData.session_id)
-    persona_details = get_persona_from_db(suggestionData.persona_id)
-    i = last_index + 1
-    while i < len(messages) - 1:
-        msg = messages[i]
-        next_msg = messages[i + 1]
-
-        if msg["role"] == "user" and next_msg["role"] == "assistant":
-            user_text = msg["content"]
-            assistant_text = next_msg["content"]
-
-            new_chat_history += f"User: {user_text}\nAssistant: {assistant_text}\n"
-            recomms = get_message_recommendation(user_text,new_chat_history,persona_details,user_details)
-            updated_recommendations.append({
-                "message_index": i,
-                "user_message": user_text,
-                "assistant_response": assistant_text,
-                "rating": recomms["rating"],
-                "suggestion": recomms["suggestion"],
-                "next_move": recomms["next_move"]
-            })
-
-            i += 2
-        else:
-            i += 1
-
-
-    update_recommendations(
-        suggestionData.session_id,
-        suggestionData.persona_id,
-        updated_recommendations,
-        new_chat_history
-    )
+    existing_recs, updated_recommendations = result
     
     return {
         "status": "success",
         "new_recommendations_added": len(updated_recommendations),
         "recommendations": existing_recs + updated_recommendations
     }
-
@@ -1,12 +1,204 @@
-import google.generativeai as genai
+from services.scheduler import INTERACTIVE, LLMOverloaded, admit, scheduler
 from dotenv import load_dotenv
+import asyncio
+import hashlib
+import math
 import os
+import random
+import re
 
 load_dotenv()
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = genai.GenerativeModel("gemini-2.0-flash")
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.0-flash")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
 
-def get_gemini_response(prompt):
-    response = model.generate_content(prompt)
-    return response.text.strip()
+
+class LLMBackend:
+    """Interface every model backend implements"""
+
+    async def generate(self, prompt) -> str:
+        raise NotImplementedError
+
+    async def stream(self, prompt):
+        """Yield the reply in chunks as the model produces them"""
+        yield await self.generate(prompt)
+
+
+class GeminiBackend(LLMBackend):
+    def __init__(self, model_name=LLM_MODEL):
+        # Imported here so the app starts without loading the Gemini SDK
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        self.model = genai.GenerativeModel(model_name)
+
+    async def generate(self, prompt) -> str:
+        response = await self.model.generate_content_async(prompt)
+        return response.text.strip()
+
+    async def stream(self, prompt):
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend(LLMBackend):
+    """Deterministic local model for tests and offline runs.
+
+    The reply only depends on the prompt, so the same input always gives
+    the same output. Prompts that ask for JSON get a valid recommendation
+    (or an array of them for batched coaching prompts).
+    """
+
+    def __init__(self, latency=0.0):
+        # Seconds per call, or a zero-argument callable drawing them (see parse_latency)
+        self.latency = latency
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency() if callable(self.latency) else self.latency)
+
+    async def generate(self, prompt) -> str:
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return self._reply(prompt)
+
+    def _reply(self, prompt) -> str:
+        text = _prompt_text(prompt)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if "JSON array" in text:
+            items = [
+                self._recommendation(f"{digest}{index}")[:-1] + f', "message_index": {index}}}'
+                for index in re.findall(r"\[message_index: (\d+)\]", text)
+            ]
+            return "[" + ", ".join(items) + "]"
+        if "JSON" in text:
+            return self._recommendation(digest)
+        return f"fake reply {digest[:12]}"
+
+    def _recommendation(self, seed) -> str:
+        digest = hashlib.sha256(seed.encode("utf-8")).hexdigest()
+        return (
+            '{"rating": %d, "suggestion": "fake suggestion %s", '
+            '"next_move": "fake next move %s", "reasoning": "fake"}'
+            % (int(digest[0], 16) % 5 + 1, digest[:8], digest[8:16])
+        )
+
+    async def stream(self, prompt):
+        words = self._reply(prompt).split(" ")
+        delay = self._delay()
+        for i, word in enumerate(words):
+            if delay:
+                await asyncio.sleep(delay / len(words))
+            yield word if i == 0 else " " + word
+
+
+def _prompt_text(prompt) -> str:
+    if isinstance(prompt, str):
+        return prompt
+    return "\n".join(
+        str(part) for msg in prompt for part in msg.get("parts", [])
+    )
+
+
+def parse_latency(spec, seed=None):
+    """Fake latency from a spec: "0.2" (fixed seconds), "uniform:low,high",
+    "normal:mean,stddev" or "lognormal:median,sigma"."""
+    kind, _, args = spec.partition(":")
+    if not args:
+        return float(kind)
+    a, b = (float(x) for x in args.split(","))
+    rng = random.Random(seed)
+    if kind == "uniform":
+        return lambda: rng.uniform(a, b)
+    if kind == "normal":
+        return lambda: rng.gauss(a, b)
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(math.log(a), b)
+    raise ValueError(f"Unknown latency distribution: {kind}")
+
+
+def _make_backend(name) -> LLMBackend:
+    if name == "fake":
+        return FakeBackend(latency=parse_latency(os.getenv("LLM_FAKE_LATENCY", "0")))
+    return GeminiBackend()
+
+
+_backend = None
+
+
+def get_backend() -> LLMBackend:
+    global _backend
+    if _backend is None:
+        _backend = _make_backend(LLM_BACKEND)
+    return _backend
+
+
+def backend_ready():
+    return _backend is not None
+
+
+def set_backend(backend: LLMBackend):
+    """Swap the model backend (e.g. FakeBackend in tests)"""
+    global _backend
+    _backend = backend
+
+
+def _backoff_delay(attempt) -> float:
+    # Full jitter: sleep a random amount up to the exponential cap
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+
+async def get_gemini_response(prompt, priority=INTERACTIVE):
+    """Run the prompt on the configured backend without blocking the event loop.
+
+    Calls are admitted by the scheduler (see services/scheduler.py) under
+    their priority class; a shed call raises LLMOverloaded. Per-user rate
+    limits are charged by the routes, not here. Each attempt has a timeout and failures are retried with
+    jittered exponential backoff.
+    """
+    backend = get_backend()
+    admit(priority)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            async with scheduler.slot(priority):
+                return await asyncio.wait_for(backend.generate(prompt), LLM_TIMEOUT)
+        except LLMOverloaded:
+            raise
+        except Exception:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+        await asyncio.sleep(_backoff_delay(attempt))
+
+
+async def stream_gemini_response(prompt, priority=INTERACTIVE):
+    """Stream the reply chunk by chunk.
+
+    The scheduler slot is held until the stream finishes. Failures are only
+    retried before the first chunk was handed out; LLM_TIMEOUT applies to the
+    wait for each chunk.
+    """
+    backend = get_backend()
+    admit(priority)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        started = False
+        try:
+            async with scheduler.slot(priority):
+                chunks = backend.stream(prompt).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), LLM_TIMEOUT)
+                    except StopAsyncIteration:
+                        return
+                    started = True
+                    yield chunk
+        except LLMOverloaded:
+            raise
+        except Exception:
+            if started or attempt == LLM_MAX_RETRIES:
+                raise
+        await asyncio.sleep(_backoff_delay(attempt))
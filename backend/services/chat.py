@@ -1,11 +1,21 @@
-from db.mongo import get_messages, save_message, get_summary, save_summary
-from db.vector import add_to_vector_db, query_similar
-from services.agent import get_gemini_response
-from db.persona import get_persona_prompt, get_persona_from_db
+from db.mongo import get_recent_context, save_messages
+from db.vector import query_similar
+from db.vector_ingest import enqueue_memory
+from db.embeddings import embed
+from services.agent import get_gemini_response, stream_gemini_response
+from services.precompute import enqueue_recommendation
+from services.summarizer import enqueue_summary, needs_summary
+from services.context import SECTION_BUDGETS, assemble_context, fit_text
+from db.persona import get_persona_prompt, get_persona_from_db, get_persona_derived
+from services.scheduler import INTERACTIVE
+from services.telemetry import span
+import asyncio
+import logging
 
 
 MAX_TURNS = 10
-SUMMARY_TRIGGER = 25
+
+logger = logging.getLogger(__name__)
 
 from db.persona import get_persona_prompt
 
@@ -52,60 +62,55 @@ HUMAN TEXTING BEHAVIOR - CRITICAL RULES:
 Remember: You're not trying to be helpful or please the user. You're being yourself - {persona['name']} - with all your quirks, moods, and authentic human responses."""
 
 
-def compress_previous_chat(previous_chat: str, max_words: int = 150) -> str:
-    """Compress previous chat history to key points"""
-    if not previous_chat:
-        return ""
-    
-    words = previous_chat.split()
-    if len(words) <= max_words:
-        return previous_chat
-    
-    # Take key parts: beginning and end
-    start = " ".join(words[:75])
-    end = " ".join(words[-75:])
-    return f"{start}... [conversation continued] ...{end}"
+def compress_previous_chat(previous_chat: str, max_tokens: int = SECTION_BUDGETS["previous_chat"]) -> str:
+    """Compress previous chat history to its beginning and end, within max_tokens"""
+    return fit_text(previous_chat, max_tokens, keep="ends")
 
 
-def chat(session_id: str, persona_id: str, user_input: str):
-    save_message(session_id, persona_id, "user", user_input)
-    add_to_vector_db(session_id, persona_id, "user", user_input)
-    
-    # Load memory - using your existing functions
-    history = get_messages(session_id, persona_id)[-MAX_TURNS:]
-    summary = get_summary(session_id, persona_id)  # Using your existing summary
-    retrieved_chunks = query_similar(session_id, persona_id, user_input)
-    persona = get_persona_from_db(persona_id)
-    
-    if not persona:
-        return "Select Valid Persona"
-    
-    # Build efficient system context
-    print(persona)
-    
-    system_context = build_persona_prompt(persona)
-    
-    # Add your existing summary if available
-    if summary:
-        system_context += f"\n\nCONVERSATION SUMMARY:\n{summary}"
+async def _build_context(session_id: str, persona_id: str, user_input: str):
+    """Load memory and assemble the prompt for the model.
+
+    Returns None when the persona does not exist. Nothing is written to Mongo
+    here; the user message is saved together with the reply.
+    """
+    # One embedding serves both the similarity query and the memory insert
+    with span("embed"):
+        user_embedding = await embed(user_input)
     
-    # Add compressed previous chat context
-    if persona['chat_history']:
-        compressed_prev = compress_previous_chat(persona['chat_history'])
-        if compressed_prev:
-            system_context += f"\n\nPREVIOUS CHAT CONTEXT (Your relationship dynamic with this person):\n{compressed_prev}"
+    # Recent turns and summary come back in one query
+    with span("mongo_read"):
+        convo = await get_recent_context(session_id, persona_id, MAX_TURNS)
+    history = convo["messages"]
+    summary = convo["summary"]
+    with span("chroma_query"):
+        # A hot-index load or a Chroma query would stall every other request on the loop
+        retrieved_chunks = await asyncio.to_thread(
+            query_similar, session_id, persona_id, user_input, query_embedding=user_embedding
+        )
+    with span("persona"):
+        persona = await get_persona_from_db(persona_id)
+        
+        if not persona:
+            return None
+        
+        persona_prompt = await get_persona_derived(persona_id, "prompt", build_persona_prompt)
+        compressed_prev = None
+        if persona['chat_history']:
+            compressed_prev = await get_persona_derived(
+                persona_id, "previous_chat", lambda p: compress_previous_chat(p['chat_history'])
+            )
     
-    # Add relevant memories (limit to top 3)
-    if retrieved_chunks:
-        top_memories = retrieved_chunks[:5]
-        memory_text = "\n".join(top_memories)
-        system_context += f"\n\nRELEVANT SHARED MEMORIES:\n{memory_text}"
-        print(memory_text)
-
+    # Every section is trimmed to its share of the token budget
+    with span("context"):
+        system_context, turns, report = assemble_context(
+            persona_prompt, user_input, history,
+            summary=summary, memories=retrieved_chunks, previous_chat=compressed_prev
+        )
+    logger.debug("context assembled", extra={"fields": {"context_tokens": report}})
     
     # Build conversation context
     context = []
-    for msg in history:
+    for msg in turns:
         context.append({"role": msg["role"], "parts": [msg["content"]]})
     
     # Add current input with system context
@@ -113,22 +118,88 @@ def chat(session_id: str, persona_id: str, user_input: str):
         "role": "user",
         "parts": [f"{system_context}\n\nUser just texted: {user_input}\n\nRespond as {persona['name']} would naturally respond:"]
     })
+    return context, convo, user_embedding
+
+
+class PersonaNotFound(LookupError):
+    """The persona asked for does not exist"""
+
+
+# Saves that must outlive the request that started them
+_background = set()
+
+
+def _saved(task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Error saving streamed reply", exc_info=task.exception())
+
+
+async def _save_user_message(session_id: str, persona_id: str, user_input: str, user_embedding):
+    """Persist the user message on its own; returns its seq"""
+    with span("mongo_write"):
+        seq = await save_messages(session_id, persona_id, [{"role": "user", "content": user_input}])
+    await enqueue_memory(session_id, persona_id, "user", user_input, embedding=user_embedding, seq=seq)
+    return seq
+
+
+async def _finish_reply(session_id: str, persona_id: str, reply: str, convo, user_seq):
+    """Persist the reply to the user message stored at user_seq, and queue a
+    summary refresh if needed"""
+    with span("mongo_write"):
+        reply_seq = await save_messages(session_id, persona_id, [{"role": "assistant", "content": reply}])
+    # Vector memories are written behind the response
+    with span("embed"):
+        reply_embedding = await embed(reply)
+    await enqueue_memory(session_id, persona_id, "assistant", reply, embedding=reply_embedding, seq=reply_seq)
+    enqueue_recommendation(session_id, persona_id, user_seq)
     
-    # Get response
-    reply = get_gemini_response(context)
-    
-    # Save reply
-    save_message(session_id, persona_id, "assistant", reply)
-    add_to_vector_db(session_id, persona_id, "assistant", reply)
+    # The summary is brought up to date in the background, after the reply
+    if needs_summary(reply_seq + 1, convo["summary_watermark"]):
+        enqueue_summary(session_id, persona_id)
+
+
+async def chat(session_id: str, persona_id: str, user_input: str):
+    built = await _build_context(session_id, persona_id, user_input)
+    if built is None:
+        return "Select Valid Persona"
+    context, convo, user_embedding = built
+    # Saved first, so a shed or failed generation doesn't lose the user's turn
+    user_seq = await _save_user_message(session_id, persona_id, user_input, user_embedding)
     
-    # Use your existing summarization logic
-    if len(history) + 1 > SUMMARY_TRIGGER:
-        all_msgs = get_messages(session_id, persona_id)
-        full_text = "\n".join([f"{m['role']}: {m['content']}" for m in all_msgs])
-        summary_prompt = [
-            {"role": "user", "parts": [f"Summarize this conversation focusing on relationship development, emotional dynamics, and key personality traits shown:\n{full_text}"]}
-        ]
-        summary_text = get_gemini_response(summary_prompt)
-        save_summary(session_id, persona_id, summary_text)
+    # Get response
+    with span("llm"):
+        reply = await get_gemini_response(context, priority=INTERACTIVE)
     
+    await _finish_reply(session_id, persona_id, reply, convo, user_seq)
     return reply
+
+
+async def chat_stream(session_id: str, persona_id: str, user_input: str):
+    """Same as chat() but yields the reply as it is generated.
+
+    The user message is saved before the model is called and the reply once
+    the stream ends, also when the client disconnects midway (whatever was
+    generated by then is kept). Raises PersonaNotFound for an unknown persona.
+    """
+    built = await _build_context(session_id, persona_id, user_input)
+    if built is None:
+        raise PersonaNotFound("Select Valid Persona")
+    context, convo, user_embedding = built
+    user_seq = await _save_user_message(session_id, persona_id, user_input, user_embedding)
+    
+    parts = []
+    try:
+        # Includes the time the client takes to consume each chunk
+        with span("llm_stream"):
+            async for chunk in stream_gemini_response(context, priority=INTERACTIVE):
+                parts.append(chunk)
+                yield chunk
+    finally:
+        reply = "".join(parts).strip()
+        if reply:
+            # Its own task: a disconnect cancels this generator, not the save
+            save = asyncio.ensure_future(_finish_reply(session_id, persona_id, reply, convo, user_seq))
+            _background.add(save)
+            save.add_done_callback(_saved)
+            await asyncio.shield(save)
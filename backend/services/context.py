@@ -0,0 +1,196 @@
+"""Token-budgeted prompt assembly for chat().
+
+The prompt is made of sections: the persona prompt, the recent turns, the
+conversation summary, retrieved memories and the persona's previous chat.
+Sections are filled in priority order, each up to its own budget and never
+past what is left of CONTEXT_TOKEN_BUDGET. The persona prompt and the
+current message are always kept. Retrieved memories that repeat the recent
+turns are dropped before they are counted.
+
+Token counts come from a pluggable estimate (CONTEXT_TOKENIZER):
+  chars             ~4 characters per token (default, free)
+  words             ~1.3 tokens per word
+  file:<path>       a HuggingFace tokenizer.json, via the tokenizers package
+or any callable passed to set_token_counter().
+"""
+from dotenv import load_dotenv
+import math
+import os
+import re
+
+load_dotenv()
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "chars")
+CONTEXT_MAX_MEMORIES = int(os.getenv("CONTEXT_MAX_MEMORIES", "5"))
+# Highest priority first; persona is always included
+CONTEXT_PRIORITY = [
+    s.strip() for s in os.getenv("CONTEXT_PRIORITY", "persona,history,summary,memories,previous_chat").split(",")
+    if s.strip()
+]
+SECTION_BUDGETS = {
+    "persona": None,  # never trimmed
+    "history": int(os.getenv("CONTEXT_HISTORY_TOKENS", "1500")),
+    "summary": int(os.getenv("CONTEXT_SUMMARY_TOKENS", "400")),
+    "memories": int(os.getenv("CONTEXT_MEMORY_TOKENS", "400")),
+    "previous_chat": int(os.getenv("CONTEXT_PREVIOUS_CHAT_TOKENS", "300"))
+}
+
+# Role/formatting overhead the model adds per turn
+TURN_OVERHEAD_TOKENS = 4
+
+
+def _chars(text):
+    return math.ceil(len(text) / 4)
+
+
+def _words(text):
+    return math.ceil(len(text.split()) * 1.3)
+
+
+def _load_counter(spec):
+    if spec == "chars":
+        return _chars
+    if spec == "words":
+        return _words
+    if spec.startswith("file:"):
+        from tokenizers import Tokenizer
+        tokenizer = Tokenizer.from_file(spec[len("file:"):])
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+    raise ValueError(f"Unknown CONTEXT_TOKENIZER: {spec}")
+
+
+_count_tokens = None
+
+
+def count_tokens(text):
+    global _count_tokens
+    if _count_tokens is None:
+        _count_tokens = _load_counter(CONTEXT_TOKENIZER)
+    return _count_tokens(text) if text else 0
+
+
+def set_token_counter(counter):
+    """Swap the token estimate, e.g. for a model-specific tokenizer"""
+    global _count_tokens
+    _count_tokens = counter
+
+
+def fit_text(text, budget, keep="head"):
+    """Trim text to at most budget tokens, cutting on word boundaries.
+
+    keep="head" keeps the beginning, keep="ends" keeps the beginning and the
+    end with a marker in between.
+    """
+    if not text or budget <= 0:
+        return ""
+    if count_tokens(text) <= budget:
+        return text
+
+    words = text.split()
+
+    def render(n):
+        if keep == "ends":
+            head = " ".join(words[:(n + 1) // 2])
+            tail = " ".join(words[len(words) - n // 2:]) if n // 2 else ""
+            return f"{head} ... [conversation continued] ... {tail}".strip()
+        return " ".join(words[:n]) + " ..."
+
+    # Largest word count that fits
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(render(mid)) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return render(lo) if lo else ""
+
+
+def _normalise(text):
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+
+def dedupe_memories(memories, history, user_input=""):
+    """Drop retrieved memories already present in the recent turns (or repeated)"""
+    seen = {_normalise(m["content"]) for m in history}
+    seen.add(_normalise(user_input))
+    out = []
+    for memory in memories:
+        key = _normalise(memory)
+        if key and key not in seen:
+            seen.add(key)
+            out.append(memory)
+    return out
+
+
+def assemble_context(persona_prompt, user_input, history, summary=None, memories=None,
+                     previous_chat=None, budget=CONTEXT_TOKEN_BUDGET, priority=CONTEXT_PRIORITY):
+    """Fit the prompt sections into the token budget.
+
+    Returns (system_context, turns, report): the system text, the recent
+    turns to send (oldest first) and a report with the tokens each section
+    used, the total and what was dropped.
+    """
+    memories = dedupe_memories(memories or [], history, user_input)[:CONTEXT_MAX_MEMORIES]
+
+    used = {"persona": count_tokens(persona_prompt), "input": count_tokens(user_input)}
+    remaining = budget - used["persona"] - used["input"]
+    parts = {}
+    turns = []
+    dropped = {"history": 0, "memories": 0}
+
+    for name in priority:
+        allowance = max(0, remaining)
+        if SECTION_BUDGETS.get(name) is not None:
+            allowance = min(allowance, SECTION_BUDGETS[name])
+
+        if name == "history":
+            spent = 0
+            # Newest turns matter most
+            for msg in reversed(history):
+                cost = count_tokens(msg["content"]) + TURN_OVERHEAD_TOKENS
+                if spent + cost > allowance:
+                    break
+                turns.append(msg)
+                spent += cost
+            turns.reverse()
+            dropped["history"] = len(history) - len(turns)
+        elif name == "memories":
+            spent = 0
+            kept = []
+            for memory in memories:
+                cost = count_tokens(memory) + 1
+                if spent + cost > allowance:
+                    continue
+                kept.append(memory)
+                spent += cost
+            dropped["memories"] = len(memories) - len(kept)
+            if kept:
+                parts["memories"] = "\n".join(kept)
+        elif name == "summary":
+            parts["summary"] = fit_text(summary, allowance)
+            spent = count_tokens(parts["summary"])
+        elif name == "previous_chat":
+            parts["previous_chat"] = fit_text(previous_chat, allowance, keep="ends")
+            spent = count_tokens(parts["previous_chat"])
+        else:
+            continue
+        used[name] = spent
+        remaining -= spent
+
+    system_context = persona_prompt
+    if parts.get("summary"):
+        system_context += f"\n\nCONVERSATION SUMMARY:\n{parts['summary']}"
+    if parts.get("previous_chat"):
+        system_context += f"\n\nPREVIOUS CHAT CONTEXT (Your relationship dynamic with this person):\n{parts['previous_chat']}"
+    if parts.get("memories"):
+        system_context += f"\n\nRELEVANT SHARED MEMORIES:\n{parts['memories']}"
+
+    report = {
+        "sections": used,
+        "total": sum(used.values()),
+        "budget": budget,
+        "dropped": dropped
+    }
+    return system_context, turns, report
@@ -0,0 +1,78 @@
+"""Background precompute of recommendations.
+
+After chat() saves an assistant reply it can enqueue the new user/assistant
+pair here. A single in-process worker runs the same refresh as /suggest, so
+by the time the user asks for coaching the result is usually already stored
+in the recommendations collection.
+"""
+from services.recommendation import refresh_recommendations
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PRECOMPUTE_RECOMMENDATIONS = os.getenv("PRECOMPUTE_RECOMMENDATIONS", "false").lower() in ("1", "true", "yes")
+PRECOMPUTE_QUEUE_SIZE = int(os.getenv("PRECOMPUTE_QUEUE_SIZE", "1000"))
+
+_queue = None
+_pending = set()
+_worker = None
+
+
+def enqueue_recommendation(session_id, persona_id, message_index):
+    """Queue a recommendation for the pair starting at message_index.
+
+    Returns False when precompute is off, the pair is already queued or the
+    queue is full; /suggest will pick the pair up in that case.
+    """
+    if _queue is None:
+        return False
+
+    key = (session_id, persona_id, message_index)
+    if key in _pending:
+        return False
+    try:
+        _queue.put_nowait(key)
+    except asyncio.QueueFull:
+        return False
+    _pending.add(key)
+    return True
+
+
+async def _run():
+    while True:
+        key = await _queue.get()
+        session_id, persona_id, _ = key
+        try:
+            await refresh_recommendations(session_id, persona_id)
+        except Exception as e:
+            logger.exception("Error precomputing recommendations: %s", e)
+        finally:
+            _pending.discard(key)
+            _queue.task_done()
+
+
+def start_precompute_worker():
+    global _queue, _worker
+    if not PRECOMPUTE_RECOMMENDATIONS or _worker is not None:
+        return
+    _queue = asyncio.Queue(maxsize=PRECOMPUTE_QUEUE_SIZE)
+    _worker = asyncio.create_task(_run())
+
+
+async def stop_precompute_worker():
+    global _queue, _worker
+    if _worker is None:
+        return
+    _worker.cancel()
+    try:
+        await _worker
+    except asyncio.CancelledError:
+        pass
+    _queue = None
+    _worker = None
+    _pending.clear()
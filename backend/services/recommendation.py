@@ -1,6 +1,51 @@
 from services.agent import get_gemini_response
+from db.mongo import get_messages
+from db.persona import get_persona_from_db
+from db.user_profile import get_user_profile
+from db.recommendation import (
+    acquire_recommendation_lease,
+    append_recommendations,
+    fetch_recommendations_from_db,
+    recommendation_lease_held,
+    recommendation_state,
+    release_recommendation_lease
+)
+from db.cache import single_flight
+from db.recommendation_cache import (
+    cached_recommendation,
+    get_cached_recommendation,
+    put_cached_recommendation,
+    recommendation_key
+)
+from services.scheduler import COACHING
+from services.telemetry import counter, span
+import asyncio
 import json
+import logging
+import os
 import re
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# How many recommendation prompts may run at once for one /suggest call
+RECOMMENDATION_CONCURRENCY = int(os.getenv("RECOMMENDATION_CONCURRENCY", "4"))
+# Turn pairs packed into one prompt; 1 keeps one prompt per pair
+RECOMMENDATION_BATCH_SIZE = int(os.getenv("RECOMMENDATION_BATCH_SIZE", "1"))
+# Turns of verbatim history in each coaching prompt; older turns are summarised
+RECOMMENDATION_WINDOW_TURNS = int(os.getenv("RECOMMENDATION_WINDOW_TURNS", "6"))
+# How long a worker may hold a conversation's refresh lease, and how often others check it
+RECOMMENDATION_LEASE_SECONDS = float(os.getenv("RECOMMENDATION_LEASE_SECONDS", "120"))
+RECOMMENDATION_LEASE_POLL_MS = float(os.getenv("RECOMMENDATION_LEASE_POLL_MS", "250"))
+
+REFRESH_COALESCED = counter(
+    "rizzy_recommendation_refresh_coalesced_total",
+    "Refreshes that waited for another caller instead of analysing the turns themselves",
+    ["scope"]
+)
+
+# (session_id, persona_id) -> task of the refresh running in this process
+_inflight = {}
 
 def build_gemini_prompt(user_text, new_chat_history, persona_details, user_details):
     """Enhanced recommendation system for realistic conversation coaching"""
@@ -70,18 +115,377 @@ Return ONLY a JSON object with these fields:
 Analyze the message and provide your coaching response:
 """
 
+def build_batch_gemini_prompt(pairs, chat_history, persona_details, user_details):
+    """Coaching prompt covering several user messages at once.
+
+    The model answers with a JSON array holding one object per message,
+    tagged with the message_index it refers to.
+    """
+    items = "\n\n".join(
+        f"[message_index: {p['message_index']}]\n"
+        f"User: {p['user_message']}\n"
+        f"Assistant: {p['assistant_response']}"
+        for p in pairs
+    )
+    
+    return f"""
+You are an expert conversation coach who analyzes text conversations and provides actionable, realistic advice.
+
+Your goal is to help the user communicate more effectively with their persona by understanding:
+- **The persona's communication style, interests, and personality**
+- **The relationship dynamic** (friend, crush, boss, etc.)
+- **What actually works in real conversations** vs generic advice
+
+For EACH user message listed below, rate its effectiveness (1-5), suggest a realistic improvement
+and a strategic next move. Judge every message as of the moment it was sent.
+
+### Context Analysis:
+
+**Messages To Analyze:**
+{items}
+
+**Recent Chat History:**
+{chat_history}
+
+**Persona Profile:**
+- Name: {persona_details.get('name')}
+- Relationship: {persona_details.get('description')}
+- Personality & Style: {persona_details.get('system_prompt')}
+
+**User Profile:**
+- Name: {user_details.get('name')}
+- Bio: {user_details.get('bio')}
+- Communication Goals: {user_details.get('goals')}
+- Interests: {user_details.get('interests')}
+- Style: {user_details.get('communicationStyle')}
+
+### Response Requirements:
+
+Return ONLY a JSON array with one object per message, in the same order:
+
+[
+  {{
+    "message_index": <the message_index of the message>,
+    "rating": <integer 1-5>,
+    "suggestion": "<specific, actionable improvement for the message>",
+    "next_move": "<strategic suggestion for where to take the conversation>",
+    "reasoning": "<brief explanation of why this approach works for this specific persona>"
+  }}
+]
+
+### Guidelines:
+- **Be specific**: Instead of "be more engaging," suggest "reference the Netflix show you both mentioned"
+- **Match the persona**: Tailor advice to their communication style and interests
+- **Be realistic**: Avoid overly scripted or fake-sounding suggestions
+- **Focus on authenticity**: Help the user be a better version of themselves, not someone else
+
+Analyze the messages and provide your coaching response:
+"""
+
 def extract_json_from_text(text):
     # This regex tries to find the first {...} JSON object in the text, including nested braces
     match = re.search(r'\{.*?\}', text, re.DOTALL)
     if match:
         return match.group(0)
     return None
+
+def extract_json_array_from_text(text):
+    match = re.search(r'\[.*\]', text, re.DOTALL)
+    if match:
+        return match.group(0)
+    return None
      
-def get_message_recommendation(user_text,new_chat_history,persona_details,user_details):
-    prompt = build_gemini_prompt(user_text,new_chat_history,persona_details,user_details)
-    response = get_gemini_response(prompt)
+async def get_message_recommendation(user_text,new_chat_history,persona_details,user_details):
+    async def compute():
+        prompt = build_gemini_prompt(user_text,new_chat_history,persona_details,user_details)
+        with span("recommend.llm"):
+            response = await get_gemini_response(prompt, priority=COACHING)
+        return json.loads(extract_json_from_text(response))
+
+    # Identical inputs (retries, regenerations, a second tab) never reach the LLM twice
+    key = recommendation_key(user_text, new_chat_history, persona_details, user_details)
+    with span("recommend.message"):
+        return await cached_recommendation(key, compute)
+
+
+def _render_turns(messages):
+    return "".join(
+        f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}\n" for m in messages
+    )
+
+
+def _history_window(summary, messages):
+    history = _render_turns(messages)
+    if summary:
+        return f"Earlier in the conversation (summary): {summary}\n\n{history}"
+    return history
+
+
+def collect_turn_pairs(messages, start_seq, window_turns=RECOMMENDATION_WINDOW_TURNS):
+    """Collect the user/assistant pairs with seq >= start_seq.
+
+    Each pair records the seq its history window starts at (the last
+    window_turns turns up to and including the pair) and where it ends in
+    messages; attach_histories() turns that into its chat_history. Returns
+    the pairs and the watermark, the seq to resume from next time.
+    """
+    pairs = []
+    i = 0
+    while i < len(messages) and messages[i]["seq"] < start_seq:
+        i += 1
+    while i < len(messages) - 1:
+        msg = messages[i]
+        next_msg = messages[i + 1]
+
+        if msg["role"] == "user" and next_msg["role"] == "assistant":
+            pairs.append({
+                "message_index": msg["seq"],
+                "user_message": msg["content"],
+                "assistant_response": next_msg["content"],
+                "window_seq": messages[max(0, i + 2 - 2 * window_turns)]["seq"],
+                "end": i + 2
+            })
+            i += 2
+        else:
+            i += 1
+
+    if i < len(messages):
+        # A trailing user message still waiting for its reply
+        watermark = messages[i]["seq"]
+    else:
+        watermark = messages[-1]["seq"] + 1 if messages else start_seq
+    return pairs, max(watermark, start_seq)
+
+
+def summary_checkpoint(seq, summarized_until, window):
+    """Latest point at or before seq the summary is folded up to: summarized_until plus whole windows"""
+    return summarized_until + max(0, seq - summarized_until) // window * window
+
+
+async def summaries_at(checkpoints, summary, summarized_until, messages):
+    """The rolling summary as of each checkpoint, folding forward one span at a time"""
+    summaries = {summarized_until: summary}
+    previous = summarized_until
+    for checkpoint in sorted(set(checkpoints)):
+        if checkpoint <= previous:
+            continue
+        span_messages = [m for m in messages if previous <= m["seq"] < checkpoint]
+        if span_messages:
+            summary = await fold_summary(summary, span_messages)
+        summaries[checkpoint] = summary
+        previous = checkpoint
+    return summaries
+
+
+def attach_histories(pairs, messages, summaries, summarized_until, window):
+    """Give each pair the history as it stood after it: the summary up to the
+    checkpoint before its window plus every turn from there on, so no turn
+    falls between the summary and the window"""
+    out = []
+    for pair in pairs:
+        checkpoint = summary_checkpoint(pair["window_seq"], summarized_until, window)
+        history = [m for m in messages[:pair["end"]] if m["seq"] >= checkpoint]
+        out.append({
+            "message_index": pair["message_index"],
+            "user_message": pair["user_message"],
+            "assistant_response": pair["assistant_response"],
+            "chat_history": _history_window(summaries[checkpoint], history)
+        })
+    return out
+
+
+async def fold_summary(summary, messages):
+    """Fold turns that left the history window into the rolling summary"""
+    prompt = f"""Update the running summary of this text conversation with the new messages below.
+Keep it under 150 words and focus on relationship development, recurring topics and how each side communicates.
+
+Current summary:
+{summary or "(none yet)"}
+
+New messages:
+{_render_turns(messages)}
+Updated summary:"""
+    with span("recommend.fold"):
+        return (await get_gemini_response(prompt, priority=COACHING)).strip()
+
+
+async def _recommend_batch(batch, persona_details, user_details):
+    prompt = build_batch_gemini_prompt(batch, batch[-1]["chat_history"], persona_details, user_details)
+    with span("recommend.llm"):
+        response = await get_gemini_response(prompt, priority=COACHING)
     
-    result = json.loads(extract_json_from_text(response))
-    return result
-   
+    results = {}
+    try:
+        raw = extract_json_array_from_text(response)
+        parsed = json.loads(raw) if raw else []
+        for pos, item in enumerate(parsed):
+            if not isinstance(item, dict):
+                continue
+            index = item.get("message_index")
+            if index is None and pos < len(batch):
+                index = batch[pos]["message_index"]
+            results[index] = item
+    except (ValueError, TypeError):
+        pass
+    
+    # Anything the model skipped or mangled is analysed on its own
+    out = []
+    for pair in batch:
+        result = results.get(pair["message_index"])
+        if not result or "rating" not in result:
+            result = await get_message_recommendation(
+                pair["user_message"], pair["chat_history"], persona_details, user_details
+            )
+        else:
+            await put_cached_recommendation(pair["cache_key"], result)
+        out.append(result)
+    return out
+
+
+async def get_message_recommendations(pairs, persona_details, user_details,
+                                      concurrency=RECOMMENDATION_CONCURRENCY,
+                                      batch_size=RECOMMENDATION_BATCH_SIZE):
+    """Analyse many turn pairs concurrently, optionally several per prompt.
+
+    Returns recommendation records in the same order as pairs.
+    """
+    pairs = [
+        {**p, "cache_key": recommendation_key(p["user_message"], p["chat_history"], persona_details, user_details)}
+        for p in pairs
+    ]
+    # Only pairs without a cached result are sent to the model
+    with span("recommend.cache"):
+        cached = await asyncio.gather(*(get_cached_recommendation(p["cache_key"]) for p in pairs))
+    missing = [p for p, hit in zip(pairs, cached) if hit is None]
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    batch_size = max(1, batch_size)
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+
+    async def run(batch):
+        async with semaphore:
+            if len(batch) == 1:
+                pair = batch[0]
+                return [await get_message_recommendation(
+                    pair["user_message"], pair["chat_history"], persona_details, user_details
+                )]
+            return await _recommend_batch(batch, persona_details, user_details)
+
+    results = await asyncio.gather(*(run(batch) for batch in batches))
+    fresh = {}
+    for batch, batch_results in zip(batches, results):
+        for pair, recomms in zip(batch, batch_results):
+            fresh[pair["message_index"]] = recomms
+
+    records = []
+    for pair, hit in zip(pairs, cached):
+        recomms = hit if hit is not None else fresh[pair["message_index"]]
+        records.append({
+            "message_index": pair["message_index"],
+            "user_message": pair["user_message"],
+            "assistant_response": pair["assistant_response"],
+            "rating": recomms["rating"],
+            "suggestion": recomms["suggestion"],
+            "next_move": recomms["next_move"]
+        })
+    return records
+
+
+async def refresh_recommendations(session_id, persona_id):
+    """Analyse the turn pairs past the stored watermark and append them.
+
+    At most one refresh per conversation runs at a time: concurrent callers in
+    this process share its result (one of them going away doesn't cancel it
+    for the rest), and callers in other workers wait on the
+    conversation's Mongo lease and then read what was stored. Returns
+    (existing_recs, new_recs), or None if there is no chat history.
+    """
+    key = (session_id, persona_id)
+    if key in _inflight:
+        REFRESH_COALESCED.inc(scope="process")
+    return await single_flight(_inflight, key, lambda: _refresh_with_lease(session_id, persona_id))
+
+
+async def _refresh_with_lease(session_id, persona_id):
+    owner = uuid.uuid4().hex
+    while True:
+        try:
+            acquired = await acquire_recommendation_lease(
+                session_id, persona_id, owner, RECOMMENDATION_LEASE_SECONDS
+            )
+        except Exception as e:
+            # Without the lease, the conditional append still keeps results consistent
+            logger.warning("Recommendation lease unavailable, refreshing without it: %s", e)
+            return await _refresh(session_id, persona_id)
+
+        if acquired:
+            try:
+                return await _refresh(session_id, persona_id)
+            finally:
+                await release_recommendation_lease(session_id, persona_id, owner)
+
+        # Another worker is analysing these turns; once it is done the refresh
+        # below finds them stored and only reads
+        REFRESH_COALESCED.inc(scope="lease")
+        with span("recommend.lease_wait"):
+            while await recommendation_lease_held(session_id, persona_id):
+                await asyncio.sleep(RECOMMENDATION_LEASE_POLL_MS / 1000)
+
+
+async def _refresh(session_id, persona_id):
+    """Analyse the turn pairs past the stored watermark and append them.
+
+    Only messages from the start of the rolling summary's tail onwards are
+    read, so the cost is proportional to the new turns. Returns
+    (existing_recs, new_recs), or None if there is no chat history.
+    """
+    with span("recommend.mongo_read"):
+        rec_doc = await fetch_recommendations_from_db(session_id, persona_id)
+    state = recommendation_state(rec_doc)
+    existing_recs = state["recommendations"]
+    window = 2 * RECOMMENDATION_WINDOW_TURNS
+
+    summary = state["summary"]
+    summarized_until = state["summarized_until"]
+    if summarized_until is None:
+        # New or legacy conversation: no summary yet, start just before the watermark
+        summarized_until = max(0, state["watermark"] - window)
+
+    with span("recommend.mongo_read"):
+        messages = await get_messages(session_id, persona_id, since=summarized_until)
+    if not messages and not existing_recs:
+        return None
+
+    pairs, watermark = collect_turn_pairs(messages, state["watermark"])
+    if not pairs and watermark == state["watermark"] and state["stored_watermark"] is not None:
+        return existing_recs, []
+
+    # Fold a window's worth of turns at a time so summarising stays occasional;
+    # the stored summary keeps at least one window of verbatim turns after it
+    checkpoints = [summary_checkpoint(p["window_seq"], summarized_until, window) for p in pairs]
+    store_at = summarized_until
+    if watermark - window - summarized_until >= window:
+        store_at = summary_checkpoint(watermark - window, summarized_until, window)
+        checkpoints.append(store_at)
+    summaries = await summaries_at(checkpoints, summary, summarized_until, messages)
+    pairs = attach_histories(pairs, messages, summaries, summarized_until, window)
+
+    new_recs = []
+    if pairs:
+        with span("recommend.profile"):
+            user_details, persona_details = await asyncio.gather(
+                get_user_profile(session_id),
+                get_persona_from_db(persona_id)
+            )
+        new_recs = await get_message_recommendations(pairs, persona_details, user_details)
+    summary, summarized_until = summaries[store_at], store_at
 
+    with span("recommend.mongo_write"):
+        stored = await append_recommendations(
+            session_id, persona_id, new_recs, state["stored_watermark"], watermark, summary, summarized_until
+        )
+    if not stored:
+        # A concurrent refresh analysed the same turns first; serve its results
+        rec_doc = await fetch_recommendations_from_db(session_id, persona_id)
+        return recommendation_state(rec_doc)["recommendations"], []
+    return existing_recs, new_recs
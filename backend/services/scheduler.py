@@ -0,0 +1,221 @@
+"""Admission control for LLM calls.
+
+Every call to the model goes through one scheduler per worker with three
+priority classes:
+  interactive   chat replies, someone is watching the screen
+  coaching      /suggest and recommendation precompute
+  summary       background conversation summaries
+
+At most LLM_MAX_CONCURRENCY calls run at once and the last
+LLM_INTERACTIVE_RESERVED slots are kept for interactive calls, so a burst of
+coaching backlogs can never take every slot. Waiting calls are started
+highest class first, oldest first within a class.
+
+Load is shed instead of queued forever:
+  - each user has a token bucket (LLM_USER_RATE requests/s, LLM_USER_BURST)
+    charged once per API request by charge_user(), however many LLM calls
+    the request fans out into; an empty bucket is a 429
+  - each class has a bounded queue and a deadline for the wait in it; a full
+    queue, a call that waited past its deadline or one that would clearly not
+    start in time is a 503
+Both carry a Retry-After hint.
+"""
+from collections import deque
+from db.cache import TTLCache
+from services.telemetry import counter, gauge_callback, histogram
+from dotenv import load_dotenv
+import asyncio
+import os
+import threading
+import time
+
+load_dotenv()
+
+INTERACTIVE = "interactive"
+COACHING = "coaching"
+SUMMARY = "summary"
+PRIORITIES = (INTERACTIVE, COACHING, SUMMARY)
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_INTERACTIVE_RESERVED = int(os.getenv("LLM_INTERACTIVE_RESERVED", str(max(1, LLM_MAX_CONCURRENCY // 4))))
+LLM_QUEUE_LIMITS = {
+    INTERACTIVE: int(os.getenv("LLM_QUEUE_INTERACTIVE", "256")),
+    COACHING: int(os.getenv("LLM_QUEUE_COACHING", "256")),
+    SUMMARY: int(os.getenv("LLM_QUEUE_SUMMARY", "1000"))
+}
+# Longest a call may wait for a slot, in seconds
+LLM_DEADLINES = {
+    INTERACTIVE: float(os.getenv("LLM_DEADLINE_INTERACTIVE", "5")),
+    COACHING: float(os.getenv("LLM_DEADLINE_COACHING", "15")),
+    SUMMARY: float(os.getenv("LLM_DEADLINE_SUMMARY", "120"))
+}
+LLM_USER_RATE = float(os.getenv("LLM_USER_RATE", "0.5"))  # 0 disables per-user limits
+LLM_USER_BURST = float(os.getenv("LLM_USER_BURST", "20"))
+
+QUEUE_WAIT = histogram("rizzy_llm_queue_wait_seconds", "Time LLM calls waited for a slot", ["priority"])
+SHED = counter("rizzy_llm_shed_total", "LLM calls rejected before reaching the model", ["priority", "reason"])
+
+
+class LLMOverloaded(Exception):
+    """The call was shed; surfaced to clients as a 503 with Retry-After"""
+
+    status_code = 503
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMRateLimited(LLMOverloaded):
+    """The user's token bucket is empty; surfaced as a 429"""
+
+    status_code = 429
+
+
+class TokenBuckets:
+    """One token bucket per user, refilled at `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate, burst, maxsize=100_000):
+        self.rate = rate
+        self.burst = burst
+        # An idle bucket is full again after burst / rate seconds, so it can be forgotten
+        self._buckets = TTLCache(maxsize=maxsize, ttl=burst / rate if rate > 0 else 1.0)
+        self._lock = threading.Lock()
+
+    def take(self, user, cost=1.0):
+        """Spend cost tokens. Returns 0 on success, else seconds until enough are available."""
+        if self.rate <= 0 or user is None:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(user) or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < cost:
+                self._buckets.set(user, (tokens, now))
+                return (cost - tokens) / self.rate
+            self._buckets.set(user, (tokens - cost, now))
+            return 0.0
+
+
+class Scheduler:
+    def __init__(self, capacity=LLM_MAX_CONCURRENCY, reserved=LLM_INTERACTIVE_RESERVED,
+                 queue_limits=LLM_QUEUE_LIMITS, deadlines=LLM_DEADLINES):
+        self.capacity = max(1, capacity)
+        self.reserved = min(max(0, reserved), self.capacity - 1)
+        self.queue_limits = queue_limits
+        self.deadlines = deadlines
+        self.in_flight = 0
+        self._queues = {p: deque() for p in PRIORITIES}
+        # Moving average of how long a call holds its slot, for early shedding
+        self._avg_hold = None
+
+    def _limit(self, priority):
+        return self.capacity if priority == INTERACTIVE else self.capacity - self.reserved
+
+    def queue_depth(self, priority):
+        return len(self._queues[priority])
+
+    def _ahead(self, priority):
+        ahead = 0
+        for p in PRIORITIES:
+            ahead += len(self._queues[p])
+            if p == priority:
+                return ahead
+
+    def _shed(self, priority, reason, retry_after):
+        SHED.inc(priority=priority, reason=reason)
+        raise LLMOverloaded(f"LLM {priority} queue {reason.replace('_', ' ')}, try again shortly", retry_after)
+
+    async def acquire(self, priority):
+        started = time.monotonic()
+        if self._ahead(priority) == 0 and self.in_flight < self._limit(priority):
+            self.in_flight += 1
+            QUEUE_WAIT.observe(0.0, priority=priority)
+            return
+
+        deadline = self.deadlines[priority]
+        queue = self._queues[priority]
+        if len(queue) >= self.queue_limits[priority]:
+            self._shed(priority, "full", deadline)
+        if self._avg_hold is not None:
+            # Calls ahead of this one drain about `limit` at a time
+            expected = (self._ahead(priority) + 1) / self._limit(priority) * self._avg_hold
+            if expected > deadline:
+                self._shed(priority, "too_slow", expected)
+
+        fut = asyncio.get_running_loop().create_future()
+        queue.append(fut)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), deadline)
+        except asyncio.TimeoutError:
+            if not fut.done():
+                fut.cancel()
+                queue.remove(fut)
+                self._shed(priority, "deadline", deadline)
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted just as the caller went away; hand the slot on
+                self.release()
+            else:
+                fut.cancel()
+                if fut in queue:
+                    queue.remove(fut)
+            raise
+        QUEUE_WAIT.observe(time.monotonic() - started, priority=priority)
+
+    def release(self, held=None):
+        self.in_flight -= 1
+        if held is not None:
+            self._avg_hold = held if self._avg_hold is None else 0.8 * self._avg_hold + 0.2 * held
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self.in_flight < self._limit(priority):
+                fut = queue.popleft()
+                if not fut.done():
+                    self.in_flight += 1
+                    fut.set_result(None)
+            if queue:
+                # Lower classes never overtake a waiting higher one
+                return
+
+    def slot(self, priority):
+        return _Slot(self, priority)
+
+
+class _Slot:
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.priority)
+        self.started = time.monotonic()
+
+    async def __aexit__(self, *exc):
+        self.scheduler.release(time.monotonic() - self.started)
+
+
+scheduler = Scheduler()
+user_buckets = TokenBuckets(LLM_USER_RATE, LLM_USER_BURST)
+
+
+def admit(priority):
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority: {priority}")
+
+
+def charge_user(user, priority=INTERACTIVE):
+    """Charge one request to the user's token bucket; raises LLMRateLimited when it is empty.
+
+    Called by the routes that start LLM work on a user's behalf, not per LLM
+    call: a /suggest refresh over many turns or a summary fold costs nothing extra.
+    """
+    admit(priority)
+    wait = user_buckets.take(user)
+    if wait:
+        SHED.inc(priority=priority, reason="rate_limited")
+        raise LLMRateLimited("Too many requests, slow down", retry_after=wait)
+
+
+gauge_callback("rizzy_llm_queue_depth", "LLM calls waiting for a slot", lambda: {p: scheduler.queue_depth(p) for p in PRIORITIES}, "priority")
+gauge_callback("rizzy_llm_in_flight", "LLM calls running", lambda: scheduler.in_flight)
@@ -0,0 +1,191 @@
+"""Incremental conversation summaries, built off the request path.
+
+The conversation head stores the summary and summary_watermark, the seq of
+the first message it does not cover yet. Once SUMMARY_TRIGGER messages have
+piled up past the watermark, chat() enqueues the conversation here and
+returns its reply; a background worker folds only those new messages into
+the existing summary.
+
+Long backlogs (a migrated conversation, or one that was never summarised)
+are map-reduced: chunks of SUMMARY_CHUNK_MESSAGES are summarised in
+parallel, the partial summaries are merged SUMMARY_REDUCE_FANIN at a time,
+and the result is folded into the existing summary.
+"""
+from db.mongo import get_messages, get_summary_state, save_summary
+from services.agent import get_gemini_response
+from services.scheduler import SUMMARY
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+# New messages past the watermark before a summary refresh is queued
+SUMMARY_TRIGGER = int(os.getenv("SUMMARY_TRIGGER", "20"))
+SUMMARY_CHUNK_MESSAGES = int(os.getenv("SUMMARY_CHUNK_MESSAGES", "40"))
+SUMMARY_REDUCE_FANIN = int(os.getenv("SUMMARY_REDUCE_FANIN", "4"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "250"))
+SUMMARY_QUEUE_SIZE = int(os.getenv("SUMMARY_QUEUE_SIZE", "1000"))
+# A missing seq with this many messages stored after it is a write that never landed
+SUMMARY_GAP_GRACE = int(os.getenv("SUMMARY_GAP_GRACE", "100"))
+
+_FOCUS = "relationship development, emotional dynamics, and key personality traits shown"
+
+_queue = None
+_pending = set()
+_worker = None
+
+
+def _transcript(messages):
+    return "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+
+
+async def _ask(text):
+    response = await get_gemini_response([{"role": "user", "parts": [text]}], priority=SUMMARY)
+    return response.strip()
+
+
+async def _summarize_chunk(messages):
+    return await _ask(
+        f"Summarize this part of a conversation focusing on {_FOCUS}. "
+        f"Keep it under {SUMMARY_MAX_WORDS} words:\n{_transcript(messages)}"
+    )
+
+
+async def _merge(summaries):
+    joined = "\n\n".join(f"Part {i + 1}:\n{s}" for i, s in enumerate(summaries))
+    return await _ask(
+        f"These are summaries of consecutive parts of one conversation, in order. "
+        f"Merge them into a single summary focusing on {_FOCUS}. "
+        f"Keep it under {SUMMARY_MAX_WORDS} words:\n{joined}"
+    )
+
+
+async def _fold(summary, new_text):
+    return await _ask(
+        f"Here is the summary of a conversation so far:\n{summary}\n\n"
+        f"Update it with what happened next, focusing on {_FOCUS}. "
+        f"Keep it under {SUMMARY_MAX_WORDS} words:\n{new_text}"
+    )
+
+
+async def build_summary(summary, messages):
+    """Fold messages into summary (None for a fresh one), map-reducing long backlogs"""
+    if len(messages) <= SUMMARY_CHUNK_MESSAGES:
+        if summary:
+            return await _fold(summary, _transcript(messages))
+        return await _summarize_chunk(messages)
+
+    semaphore = asyncio.Semaphore(max(1, SUMMARY_CONCURRENCY))
+
+    async def limited(coro):
+        async with semaphore:
+            return await coro
+
+    chunks = [messages[i:i + SUMMARY_CHUNK_MESSAGES] for i in range(0, len(messages), SUMMARY_CHUNK_MESSAGES)]
+    partials = await asyncio.gather(*(limited(_summarize_chunk(c)) for c in chunks))
+
+    fanin = max(2, SUMMARY_REDUCE_FANIN)
+    while len(partials) > 1:
+        groups = [partials[i:i + fanin] for i in range(0, len(partials), fanin)]
+        merged = iter(await asyncio.gather(*(limited(_merge(g)) for g in groups if len(g) > 1)))
+        partials = [next(merged) if len(g) > 1 else g[0] for g in groups]
+
+    if summary:
+        return await _fold(summary, partials[0])
+    return partials[0]
+
+
+async def summarize_conversation(session_id, persona_id):
+    """Bring the stored summary up to date. Returns False if nothing changed."""
+    state = await get_summary_state(session_id, persona_id)
+    watermark = state["summary_watermark"]
+    if state["message_count"] <= watermark:
+        return False
+
+    messages = _settled(await get_messages(session_id, persona_id, since=watermark), watermark)
+    if not messages:
+        return False
+    summary = await build_summary(state["summary"], messages)
+    # Lost races (another worker summarised meanwhile) are simply dropped
+    return await save_summary(
+        session_id, persona_id, summary,
+        watermark=messages[-1]["seq"] + 1, expected_watermark=watermark
+    )
+
+
+def _settled(messages, start):
+    """The messages from seq start up to the first missing seq.
+
+    save_messages reserves seqs before their messages land, so a gap is
+    usually a write still in flight; moving the watermark past it would skip
+    that message for good. Only a gap with SUMMARY_GAP_GRACE messages after
+    it is treated as lost and skipped.
+    """
+    expected = start
+    for i, message in enumerate(messages):
+        if message["seq"] != expected and len(messages) - i < SUMMARY_GAP_GRACE:
+            return messages[:i]
+        expected = message["seq"] + 1
+    return messages
+
+
+def needs_summary(message_count, summary_watermark):
+    return SUMMARY_ENABLED and message_count - (summary_watermark or 0) >= SUMMARY_TRIGGER
+
+
+def enqueue_summary(session_id, persona_id):
+    """Queue a summary refresh. Returns False when the worker is off, the
+    conversation is already queued or the queue is full; the next reply
+    will try again."""
+    if _queue is None:
+        return False
+
+    key = (session_id, persona_id)
+    if key in _pending:
+        return False
+    try:
+        _queue.put_nowait(key)
+    except asyncio.QueueFull:
+        return False
+    _pending.add(key)
+    return True
+
+
+async def _run():
+    while True:
+        key = await _queue.get()
+        try:
+            await summarize_conversation(*key)
+        except Exception as e:
+            logger.exception("Error summarizing conversation %s/%s: %s", *key, e)
+        finally:
+            _pending.discard(key)
+            _queue.task_done()
+
+
+def start_summary_worker():
+    global _queue, _worker
+    if not SUMMARY_ENABLED or _worker is not None:
+        return
+    _queue = asyncio.Queue(maxsize=SUMMARY_QUEUE_SIZE)
+    _worker = asyncio.create_task(_run())
+
+
+async def stop_summary_worker():
+    global _queue, _worker
+    if _worker is None:
+        return
+    _worker.cancel()
+    try:
+        await _worker
+    except asyncio.CancelledError:
+        pass
+    _queue = None
+    _worker = None
+    _pending.clear()
@@ -0,0 +1,277 @@
+"""Request ids, structured logs, timing spans and Prometheus metrics.
+
+Every HTTP request gets an id (taken from the X-Request-ID header or
+generated) that is echoed back in the response and attached to every log
+line written while serving it. Code wraps its stages in `with span("llm"):`,
+which records the duration in the rizzy_stage_seconds histogram and in the
+per-request breakdown logged when the request finishes.
+
+Metrics are kept in process and rendered in the Prometheus text format by
+render_metrics() (served on /metrics). With several uvicorn workers each
+worker reports its own numbers.
+"""
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import contextvars
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+_stages_var = contextvars.ContextVar("request_stages", default=None)
+
+logger = logging.getLogger("rizzy.request")
+
+
+# ---------------------------------------------------------------- metrics
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for n, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_label_text(names, key + (_number(bound),))} {count}")
+                labels = _label_text(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_number(total)}")
+                lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class GaugeCallback:
+    """Gauge read at scrape time; fn returns a number or {label value: number}"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labelname=None):
+        self.name, self.help, self.fn, self.labelname = name, help, fn, labelname
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            logging.getLogger(__name__).warning("%s %s failed: %s", self.kind, self.name, e)
+            return lines
+        if isinstance(value, dict):
+            for label, v in sorted(value.items()):
+                lines.append(f"{self.name}{_label_text((self.labelname,), (label,))} {_number(v)}")
+        else:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class CounterCallback(GaugeCallback):
+    """Counter kept elsewhere (e.g. a cache's stats) and read at scrape time"""
+
+    kind = "counter"
+
+
+_registry = []
+
+
+def counter(name, help, labelnames=()):
+    metric = Counter(name, help, labelnames)
+    _registry.append(metric)
+    return metric
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, help, labelnames, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def gauge_callback(name, help, fn, labelname=None):
+    metric = GaugeCallback(name, help, fn, labelname)
+    _registry.append(metric)
+    return metric
+
+
+def counter_callback(name, help, fn, labelname=None):
+    metric = CounterCallback(name, help, fn, labelname)
+    _registry.append(metric)
+    return metric
+
+
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = histogram("rizzy_stage_seconds", "Time spent in each stage of request handling", ["stage"])
+STAGE_ERRORS = counter("rizzy_stage_errors_total", "Stages that raised", ["stage"])
+HTTP_SECONDS = histogram("rizzy_http_request_seconds", "HTTP request latency", ["method", "route", "status"])
+HTTP_REQUESTS = counter("rizzy_http_requests_total", "HTTP requests served", ["method", "route", "status"])
+
+
+@contextmanager
+def span(stage):
+    """Time a stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        stages = _stages_var.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+# ---------------------------------------------------------------- logging
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        request_id = request_id_var.get()
+        if request_id:
+            entry["request_id"] = request_id
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        request_id = request_id_var.get()
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return f"{line} request_id={request_id}" if request_id else line
+
+
+def configure_logging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+
+# ---------------------------------------------------------------- middleware
+
+class RequestContextMiddleware:
+    """Assigns request ids, times every request and logs one line per request.
+
+    Plain ASGI rather than BaseHTTPMiddleware so streamed responses are timed
+    to their last chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:128] or uuid.uuid4().hex
+        id_token = request_id_var.set(request_id)
+        stages = {}
+        stages_token = _stages_var.set(stages)
+        status = {"code": 500}
+        started = time.perf_counter()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            # Templates, not raw paths, keep label cardinality bounded
+            route = getattr(route, "path", None) or "unmatched"
+            labels = {"method": scope["method"], "route": route, "status": str(status["code"])}
+            HTTP_SECONDS.observe(elapsed, **labels)
+            HTTP_REQUESTS.inc(**labels)
+            if route not in ("/metrics", "/healthz", "/readyz"):
+                logger.info("request", extra={"fields": {
+                    **labels,
+                    "duration_ms": round(elapsed * 1000, 2),
+                    "stages_ms": {k: round(v * 1000, 2) for k, v in stages.items()}
+                }})
+            _stages_var.reset(stages_token)
+            request_id_var.reset(id_token)
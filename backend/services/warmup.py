@@ -0,0 +1,126 @@
+"""Startup warmup and readiness.
+
+The embedder, the vector store and the LLM client all load lazily, so the
+process can answer /healthz right away. warmup() creates the Mongo indexes and
+(unless WARMUP_ON_STARTUP is off) loads the models in the background after startup,
+retrying whatever fails; /readyz reports ready once that is done and Mongo
+answers a ping, and shows the last warmup error until then.
+
+With WARMUP_ON_STARTUP off, readiness no longer waits for the models: they
+load on the first request that needs it, which a not-ready instance would
+never get. /readyz then only covers the indexes and Mongo, and says so with
+"models_gated": false.
+"""
+from db.client import get_db
+from db.mongo import ensure_indexes
+from db.recommendation import ensure_recommendation_indexes
+from db.recommendation_cache import ensure_recommendation_cache_indexes
+from db.embeddings import EMBEDDING_SOCKET, get_model
+from db.vector_store import get_store
+from services.agent import get_backend
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+import time
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+
+_state = {
+    "started_at": None,
+    "ready_at": None,
+    "error": None,
+    "components": {}
+}
+_task = None
+
+
+async def _retry(name, fn):
+    # Mongo, the embedding server or a model download may fail transiently;
+    # keep trying instead of failing readiness until the next restart
+    started = time.perf_counter()
+    while True:
+        try:
+            await fn()
+            break
+        except Exception as e:
+            _state["error"] = f"{name}: {e}"
+            logger.warning("Warmup of %s failed, retrying in %ss: %s", name, WARMUP_RETRY_SECONDS, e)
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+    _state["components"][name] = round(time.perf_counter() - started, 3)
+
+
+def _in_thread(fn):
+    # Model loading is blocking, keep the loop free for health checks
+    return lambda: asyncio.to_thread(fn)
+
+
+async def _create_indexes():
+    await ensure_indexes()
+    await ensure_recommendation_indexes()
+    await ensure_recommendation_cache_indexes()
+
+
+def _warm_embedder():
+    get_model().encode(["warmup"])
+
+
+async def _load_models():
+    await _retry("llm", _in_thread(get_backend))
+    await _retry("vector_store", _in_thread(lambda: get_store().warm()))
+    await _retry("embedding_server" if EMBEDDING_SOCKET else "embedder", _in_thread(_warm_embedder))
+
+
+async def warmup():
+    _state["started_at"] = time.time()
+    # Side by side, so a model that fails to load never holds up the indexes
+    steps = [_retry("mongo_indexes", _create_indexes)]
+    if WARMUP_ON_STARTUP:
+        steps.append(_load_models())
+    await asyncio.gather(*steps)
+    _state["error"] = None
+    _state["ready_at"] = time.time()
+
+
+def start_warmup():
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(warmup())
+
+
+async def stop_warmup():
+    global _task
+    if _task is not None and not _task.done():
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+    _task = None
+
+
+async def readiness():
+    """Ready once warmup finished and Mongo is reachable (models only count with WARMUP_ON_STARTUP)"""
+    warm = _state["ready_at"] is not None
+    try:
+        await get_db().command("ping")
+        mongo = True
+    except Exception:
+        mongo = False
+
+    status = {
+        "ready": warm and mongo,
+        "warm": warm,
+        "mongo": mongo,
+        "models_gated": WARMUP_ON_STARTUP,
+        "components": _state["components"],
+        "error": _state["error"]
+    }
+    if _state["ready_at"] is not None:
+        status["warmup_seconds"] = round(_state["ready_at"] - _state["started_at"], 3)
+    return status
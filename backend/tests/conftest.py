@@ -0,0 +1,28 @@
+"""Shared setup: the app's modules run against the in-memory stand-ins used by the bench."""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Read at import time, so set before any app module loads
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("VECTOR_STORE", "memory")
+os.environ.setdefault("PRECOMPUTE_RECOMMENDATIONS", "false")
+
+import pytest
+
+
+@pytest.fixture
+def stand_ins():
+    from bench.load import HashEmbedder
+    from bench.memory_mongo import MemoryMongoClient
+    from db import client, embeddings
+    from services.agent import FakeBackend, set_backend
+
+    previous, previous_model = client._client, embeddings._model
+    client._client = MemoryMongoClient()
+    embeddings._model = HashEmbedder()
+    set_backend(FakeBackend())
+    yield
+    client._client, embeddings._model = previous, previous_model
@@ -0,0 +1,30 @@
+from db.mongo import get_messages
+from db.persona import create_persona
+from services.agent import FakeBackend, set_backend
+from services.chat import chat
+from services.scheduler import LLMOverloaded
+import asyncio
+import pytest
+
+
+class SheddingBackend(FakeBackend):
+    async def generate(self, prompt):
+        raise LLMOverloaded("LLM interactive queue full, try again shortly")
+
+
+def test_chat_keeps_the_user_message_when_generation_fails(stand_ins):
+    async def run():
+        session_id = "user@example.com"
+        persona_id = await create_persona(session_id, "Sam", "friend", "Traits: chill endTraits", "")
+        reply = await chat(session_id, persona_id, "hey")
+
+        set_backend(SheddingBackend())
+        with pytest.raises(LLMOverloaded):
+            await chat(session_id, persona_id, "still there?")
+
+        messages = await get_messages(session_id, persona_id)
+        assert [(m["seq"], m["role"], m["content"]) for m in messages] == [
+            (0, "user", "hey"), (1, "assistant", reply), (2, "user", "still there?")
+        ]
+
+    asyncio.run(run())
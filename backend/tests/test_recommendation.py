@@ -0,0 +1,92 @@
+from db.mongo import save_messages
+from db.persona import create_persona
+from db.recommendation import acquire_recommendation_lease, fetch_recommendations_from_db, release_recommendation_lease
+from services import recommendation, scheduler
+from services.agent import FakeBackend, set_backend
+from services.recommendation import refresh_recommendations
+import asyncio
+
+
+class CountingBackend(FakeBackend):
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.calls = 0
+
+    async def generate(self, prompt):
+        self.calls += 1
+        return await super().generate(prompt)
+
+
+async def _conversation(session_id, pairs):
+    persona_id = await create_persona(session_id, "Sam", "friend", "Traits: chill endTraits", "")
+    for i in range(pairs):
+        await save_messages(session_id, persona_id, [
+            {"role": "user", "content": f"message {i}"},
+            {"role": "assistant", "content": f"reply {i}"}
+        ])
+    return persona_id
+
+
+def test_long_refresh_within_default_user_limits(stand_ins, monkeypatch):
+    # More uncached pairs than the default burst: the refresh is one request, not one per pair
+    pairs = 30
+    assert pairs > scheduler.LLM_USER_BURST
+    monkeypatch.setattr(scheduler, "user_buckets", scheduler.TokenBuckets(scheduler.LLM_USER_RATE, scheduler.LLM_USER_BURST))
+
+    async def run():
+        session_id = "user@example.com"
+        persona_id = await _conversation(session_id, pairs)
+        scheduler.charge_user(session_id, scheduler.COACHING)
+        existing, new = await refresh_recommendations(session_id, persona_id)
+        assert existing == []
+        assert [r["message_index"] for r in new] == list(range(0, 2 * pairs, 2))
+        # The fan-out drew nothing beyond the one charge
+        assert scheduler.user_buckets.take(session_id, cost=scheduler.LLM_USER_BURST - 1.5) == 0.0
+
+    asyncio.run(run())
+
+
+def test_concurrent_refreshes_share_one_run(stand_ins):
+    backend = CountingBackend(latency=0.05)
+    set_backend(backend)
+
+    async def run():
+        session_id = "user@example.com"
+        persona_id = await _conversation(session_id, 3)
+        results = await asyncio.gather(*(refresh_recommendations(session_id, persona_id) for _ in range(5)))
+        # One coaching prompt per pair, made once for all five callers
+        assert backend.calls == 3
+        assert all(r == results[0] for r in results)
+        doc = await fetch_recommendations_from_db(session_id, persona_id)
+        assert [r["message_index"] for r in doc["recommendations"]] == [0, 2, 4]
+
+    asyncio.run(run())
+
+
+def test_refresh_waits_for_another_workers_lease(stand_ins, monkeypatch):
+    monkeypatch.setattr(recommendation, "RECOMMENDATION_LEASE_POLL_MS", 10)
+    backend = CountingBackend()
+    set_backend(backend)
+
+    async def run():
+        session_id = "user@example.com"
+        persona_id = await _conversation(session_id, 2)
+        assert await acquire_recommendation_lease(session_id, persona_id, "other-worker", 60)
+
+        waiter = asyncio.create_task(refresh_recommendations(session_id, persona_id))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        assert backend.calls == 0
+
+        # The lease holder analyses the turns, appends them and lets go
+        _, appended = await recommendation._refresh(session_id, persona_id)
+        await release_recommendation_lease(session_id, persona_id, "other-worker")
+        calls = backend.calls
+
+        existing, new = await asyncio.wait_for(waiter, 1)
+        # The waiter reads what the holder appended instead of analysing again
+        assert existing == appended
+        assert new == []
+        assert backend.calls == calls
+
+    asyncio.run(run())
@@ -0,0 +1,109 @@
+from services import agent, scheduler
+from services.agent import FakeBackend, get_gemini_response, set_backend
+from services.scheduler import COACHING, INTERACTIVE, SUMMARY, LLMOverloaded, LLMRateLimited
+import asyncio
+import pytest
+
+
+def _use(monkeypatch, latency, **options):
+    """Route LLM calls through a fresh scheduler to a FakeBackend with this latency"""
+    options.setdefault("queue_limits", {p: 100 for p in scheduler.PRIORITIES})
+    options.setdefault("deadlines", {p: 10.0 for p in scheduler.PRIORITIES})
+    sched = scheduler.Scheduler(**options)
+    monkeypatch.setattr(agent, "scheduler", sched)
+    set_backend(FakeBackend(latency))
+    return sched
+
+
+def test_waiting_calls_start_highest_class_first(monkeypatch):
+    _use(monkeypatch, 0.02, capacity=1, reserved=0)
+    finished = []
+
+    async def call(name, priority):
+        await get_gemini_response(name, priority)
+        finished.append(name)
+
+    async def run():
+        blocker = asyncio.create_task(call("blocker", SUMMARY))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(call(name, priority))
+            for name, priority in [
+                ("summary", SUMMARY), ("coaching 1", COACHING), ("interactive", INTERACTIVE), ("coaching 2", COACHING)
+            ]
+        ]
+        await asyncio.gather(blocker, *waiting)
+
+    asyncio.run(run())
+    # Oldest first within a class
+    assert finished == ["blocker", "interactive", "coaching 1", "coaching 2", "summary"]
+
+
+def test_reserved_slots_stay_free_for_interactive_calls(monkeypatch):
+    sched = _use(monkeypatch, 0.2, capacity=2, reserved=1)
+
+    async def run():
+        coaching = [asyncio.create_task(get_gemini_response(f"coach {i}", COACHING)) for i in range(2)]
+        await asyncio.sleep(0.02)
+        # Only one coaching call fits outside the reserved slot
+        assert sched.in_flight == 1
+        assert sched.queue_depth(COACHING) == 1
+
+        interactive = asyncio.create_task(get_gemini_response("hello", INTERACTIVE))
+        await asyncio.sleep(0.02)
+        assert sched.in_flight == 2
+        assert sched.queue_depth(INTERACTIVE) == 0
+        await interactive
+        # The interactive call finished while the second coaching call still waited
+        assert not coaching[1].done()
+        await asyncio.gather(*coaching)
+
+    asyncio.run(run())
+
+
+def test_call_waiting_past_its_deadline_is_shed(monkeypatch):
+    sched = _use(monkeypatch, 0.3, capacity=1, reserved=0, deadlines={p: 0.05 for p in scheduler.PRIORITIES})
+
+    async def run():
+        blocker = asyncio.create_task(get_gemini_response("slow", INTERACTIVE))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloaded) as shed:
+            await get_gemini_response("late", INTERACTIVE)
+        assert not isinstance(shed.value, LLMRateLimited)
+        assert shed.value.status_code == 503
+        assert shed.value.retry_after == 0.05
+        # The shed call left no trace in the queue
+        assert sched.queue_depth(INTERACTIVE) == 0
+        await blocker
+        assert sched.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_full_queue_is_shed(monkeypatch):
+    _use(monkeypatch, 0.1, capacity=1, reserved=0, queue_limits={p: 1 for p in scheduler.PRIORITIES})
+
+    async def run():
+        running = asyncio.create_task(get_gemini_response("running", COACHING))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(get_gemini_response("queued", COACHING))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloaded):
+            await get_gemini_response("one too many", COACHING)
+        await asyncio.gather(running, queued)
+
+    asyncio.run(run())
+
+
+def test_empty_token_bucket_is_a_429(monkeypatch):
+    monkeypatch.setattr(scheduler, "user_buckets", scheduler.TokenBuckets(rate=0.5, burst=2))
+
+    scheduler.charge_user("alice@example.com", INTERACTIVE)
+    scheduler.charge_user("alice@example.com", COACHING)
+    with pytest.raises(LLMRateLimited) as limited:
+        scheduler.charge_user("alice@example.com", INTERACTIVE)
+    assert limited.value.status_code == 429
+    # One token refills in 2s at 0.5/s
+    assert 0 < limited.value.retry_after <= 2.0
+    # Buckets are per user
+    scheduler.charge_user("bob@example.com", INTERACTIVE)
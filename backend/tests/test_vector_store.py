@@ -0,0 +1,137 @@
+"""Conformance tests every VectorStore backend must pass.
+
+Memory and embedded Chroma (in every partition mode) always run. chroma-http
+runs against the server in CHROMA_TEST_URL (e.g. http://127.0.0.1:8000, as
+started by `chroma run --path /tmp/chroma-test`) and is skipped without it.
+"""
+from db.vector_store import make_store
+from urllib.parse import urlparse
+import numpy as np
+import os
+import pytest
+
+DIM = 16
+
+A = ("alice@example.com", "64b000000000000000000001")
+B = ("bob@example.com", "64b000000000000000000002")
+
+CHROMA_TEST_URL = os.getenv("CHROMA_TEST_URL")
+
+needs_server = pytest.mark.skipif(not CHROMA_TEST_URL, reason="CHROMA_TEST_URL not set")
+
+STORES = [
+    pytest.param(("memory", None), id="memory"),
+    pytest.param(("chroma", "conversation"), id="chroma-conversation"),
+    pytest.param(("chroma", "shard"), id="chroma-shard"),
+    pytest.param(("chroma", "global"), id="chroma-global"),
+    pytest.param(("chroma-http", "conversation"), id="chroma-http-conversation", marks=needs_server),
+    pytest.param(("chroma-http", "shard"), id="chroma-http-shard", marks=needs_server)
+]
+
+
+@pytest.fixture(params=STORES)
+def store(request, tmp_path, monkeypatch):
+    name, mode = request.param
+    if name == "memory":
+        store = make_store("memory")
+    elif name == "chroma":
+        monkeypatch.setenv("ANONYMIZED_TELEMETRY", "False")
+        store = make_store("chroma", path=str(tmp_path), partition_mode=mode)
+    else:
+        url = urlparse(CHROMA_TEST_URL)
+        store = make_store(
+            "chroma-http", host=url.hostname, port=url.port or (443 if url.scheme == "https" else 8000),
+            ssl=url.scheme == "https", partition_mode=mode
+        )
+    # A shared server may still hold data from an earlier run
+    store.delete_conversation(A)
+    store.delete_conversation(B)
+    yield store
+    store.delete_conversation(A)
+    store.delete_conversation(B)
+
+
+def _vec(seed):
+    v = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def _records(prefix, n, start=0):
+    return [
+        {"id": f"{prefix}_{i}", "embedding": _vec(i), "document": f"{prefix} memory {i}", "metadata": {"seq": i}}
+        for i in range(start, start + n)
+    ]
+
+
+def test_empty(store):
+    assert store.count(A) == 0
+    assert store.query(A, _vec(0), 5) == []
+    assert list(store.get_all(A)[0]) == []
+    store.delete_conversation(A)
+
+
+def test_upsert_and_query(store):
+    store.upsert(A, _records("a", 20))
+    assert store.count(A) == 20
+    # A stored vector is its own nearest neighbour
+    assert store.query(A, _vec(7), 1) == ["a memory 7"]
+    top = store.query(A, _vec(3), 5)
+    assert len(top) == 5
+    assert top[0] == "a memory 3"
+    # top_k larger than the conversation
+    assert len(store.query(A, _vec(3), 50)) == 20
+
+
+def test_upsert_replaces(store):
+    store.upsert(A, _records("a", 5))
+    store.upsert(A, [{"id": "a_2", "embedding": _vec(100), "document": "rewritten", "metadata": {"seq": 2}}])
+    assert store.count(A) == 5
+    assert store.query(A, _vec(100), 1) == ["rewritten"]
+
+
+def test_add_keeps_existing(store):
+    store.add(A, _records("a", 3))
+    store.add(A, [
+        {"id": "a_1", "embedding": _vec(200), "document": "ignored", "metadata": {}},
+        {"id": "a_9", "embedding": _vec(9), "document": "a memory 9", "metadata": {}}
+    ])
+    assert store.count(A) == 4
+    assert store.query(A, _vec(1), 1) == ["a memory 1"]
+
+
+def test_isolation(store):
+    store.upsert(A, _records("a", 5))
+    store.upsert(B, _records("b", 5))
+    assert sorted(store.query(A, _vec(1), 10)) == sorted(f"a memory {i}" for i in range(5))
+    store.delete_conversation(A)
+    assert store.count(A) == 0
+    assert store.count(B) == 5
+    assert store.query(B, _vec(4), 1) == ["b memory 4"]
+
+
+def test_batches(store):
+    store.upsert_many({A: _records("a", 4), B: _records("b", 6)})
+    assert (store.count(A), store.count(B)) == (4, 6)
+    store.add_many({A: _records("a", 2, start=3), B: _records("b", 1, start=10)})
+    assert (store.count(A), store.count(B)) == (5, 7)
+    queries = [_vec(0), _vec(2), _vec(4)]
+    assert store.query_many(A, queries, 3) == [store.query(A, q, 3) for q in queries]
+
+
+def test_get_all(store):
+    records = _records("a", 8)
+    store.upsert(A, records)
+    ids, embeddings, documents = store.get_all(A)
+    by_id = {r["id"]: r for r in records}
+    assert sorted(ids) == sorted(by_id)
+    for memory_id, embedding, document in zip(ids, embeddings, documents):
+        assert document == by_id[memory_id]["document"]
+        assert np.allclose(np.asarray(embedding, dtype=np.float32), by_id[memory_id]["embedding"], atol=1e-6)
+
+
+def test_reuse_after_delete(store):
+    store.upsert(A, _records("a", 3))
+    store.delete_conversation(A)
+    store.upsert(A, _records("c", 2))
+    assert store.count(A) == 2
+    assert store.query(A, _vec(1), 1) == ["c memory 1"]
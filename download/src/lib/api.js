@@ -21,8 +21,50 @@ export async function sendMessage({ session_id, persona_id,persona_instructions,
   return response.json();
 }
 
-export async function getHistory({ session_id, persona_id }) {
+// Streams the reply over SSE; onToken is called with each chunk as it arrives.
+// Resolves with the same shape as sendMessage once the stream is done.
+export async function sendMessageStream({ session_id, persona_id, persona_instructions, message, onToken }) {
+  const response = await fetch(`${API_BASE_URL}/send_message_stream`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ session_id, persona_id, persona_instructions, message }),
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error("Failed to send message");
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let result = { session_id, response: "" };
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "{}");
+
+      if (event === "session") result.session_id = data.session_id;
+      else if (event === "token") onToken?.(data.token);
+      else if (event === "done") result = data;
+      else if (event === "error") throw new Error(data.error || "Failed to send message");
+    }
+  }
+
+  return result;
+}
+
+export async function getHistory({ session_id, persona_id, since }) {
+  // With `since` (newest seq seen + 1) only newer messages come back
   const params = new URLSearchParams({ session_id, persona_id });
+  if (since !== undefined) params.set("since", since);
 
   const response = await fetch(`${API_BASE_URL}/get_history?${params.toString()}`);
 